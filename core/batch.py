@@ -0,0 +1,181 @@
+from itertools import islice
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .constants import ROTORS, ALPHABET
+from .config import INDEX, ROTORS_NAMES, REFLECTORS_NAMES
+from .engine import CACHE_SIZE, conf_core, compound_reflector
+
+n_ALPHABET = len(ALPHABET)
+
+BATCH_CELLS = 1 << 20   # letters decrypted per block (configurations * text length): bounds the memory of a block whatever the text length
+SHARED_SETTING = 32     # configurations with the same rotor setting (only their plugboards differ) from which its scrambler is tabulated
+
+
+# Split an iterator of configurations into blocks to decrypt a text of the given length
+def blocks(configs, length):
+    size = max(1, BATCH_CELLS // max(1, length))
+    configs = iter(configs)
+    block = list(islice(configs, size))
+    while block:
+        yield block
+        block = list(islice(configs, size))
+
+
+# Decrypt a list of integers under a block of configurations at once
+# Return a 2D array: one row per configuration
+# The scrambler of a rotor setting shared by many configurations is tabulated once for the 26 letters, then only the plugboards are applied
+# Without relabel, the output plugboard is not applied (see core.engine.crypt_configs)
+def crypt(configs, keys, relabel=True):
+    keys = numpy.asarray(keys, dtype=numpy.uint8)
+    processed = numpy.empty((len(configs), len(keys)), dtype=numpy.uint8)
+    steps = numpy.arange(len(keys))
+    
+    groups = {}
+    for i, conf in enumerate(configs):
+        key, ring, positions = conf_core(conf)
+        group = groups.setdefault(key, {}).setdefault((ring, positions), ([], []))
+        group[0].append(i)
+        group[1].append(conf.plugboard)
+    
+    for key, settings in groups.items():
+        core = _get_core(*key)
+        index, ring, positions, plugs = [], [], [], []
+        for (r, p), (rows, rowplugs) in settings.items():
+            if len(rows) >= SHARED_SETTING:
+                shifts = core.shifts(_bytes2array([p]), _bytes2array([r]), len(keys))
+                table = core.scramble(shifts, numpy.arange(n_ALPHABET)[:, None])      # table[k, i]: key k scrambled at step i
+                rowplugs = _bytes2array(rowplugs)
+                k = numpy.take_along_axis(rowplugs, numpy.broadcast_to(keys, (len(rows), len(keys))), axis=1)
+                processed[rows] = _plug(rowplugs, table[k, steps], relabel)
+            
+            else:
+                index += rows
+                ring += [r] * len(rows)
+                positions += [p] * len(rows)
+                plugs += rowplugs
+        
+        if index:
+            shifts = core.shifts(_bytes2array(positions), _bytes2array(ring), len(keys))
+            plugs = _bytes2array(plugs)
+            
+            k = numpy.take_along_axis(plugs, numpy.broadcast_to(keys, (len(index), len(keys))), axis=1)
+            k = core.scramble(shifts, k)
+            processed[index] = _plug(plugs, k, relabel)
+    
+    return processed
+
+
+def _plug(plugs, keys, relabel):
+    if relabel:
+        return numpy.take_along_axis(plugs, keys, axis=1)
+    return keys
+
+
+# Compute the index of coincidence of each row
+def calcic(processed):
+    n, length = processed.shape
+    total = length * (length-1)
+    if total == 0:
+        return numpy.zeros(n)
+    
+    offsets = numpy.arange(n)[:, None] * n_ALPHABET
+    counts = numpy.bincount((processed + offsets).ravel(), minlength=n*n_ALPHABET).reshape(n, n_ALPHABET).astype(numpy.int64)
+    return (counts * (counts-1)).sum(axis=1) / total
+
+
+# Compute the ngram score of each row from a dense table indexed by base-26 ngram codes
+def calc_ngramscore(nsize, table, processed):
+    n, length = processed.shape
+    if length < nsize:
+        return numpy.zeros(n)
+    
+    codes = numpy.zeros((n, length - (nsize-1)), dtype=numpy.intp)
+    for i in range(nsize):
+        codes = codes * n_ALPHABET + processed[:, i:length - (nsize-1) + i]
+    return table[codes].sum(axis=1, dtype=numpy.float64)
+
+
+# View the table of a modules.ngram.NgramModel as an array (no copy)
+def ngram_table(model):
+    return numpy.frombuffer(model.table, dtype=numpy.float32)
+
+
+# Compute the known plaintext score of each row
+def calc_kpscore(plaintext, processed):
+    return (processed == numpy.asarray(plaintext, dtype=numpy.uint8)).sum(axis=1)
+
+
+def _bytes2array(rows):
+    return numpy.frombuffer(b''.join(rows), dtype=numpy.uint8).reshape(len(rows), -1)
+
+
+_cores = {}
+def _get_core(reflector, rotors, fixed):
+    key = (reflector, rotors, fixed)
+    core = _cores.get(key)
+    if core is None:
+        if len(_cores) >= CACHE_SIZE:
+            del _cores[next(iter(_cores))]
+        core = _cores[key] = BatchCore(REFLECTORS_NAMES[reflector], [ROTORS_NAMES[r] for r in rotors], [(ROTORS_NAMES[r], s) for r, s in fixed])
+    return core
+
+
+# Rotors and reflector as NumPy lookup tables (fixed rotors folded into the reflector, see core.engine.conf_core)
+class BatchCore:
+    def __init__(self, reflector, rotors, fixed=()):
+        self.n_rotors = len(rotors)
+        self.reflector = numpy.array(compound_reflector(reflector, fixed), dtype=numpy.uint8)
+        
+        self.notches, self.forward, self.backward = [], [], []
+        s, k = numpy.ogrid[:n_ALPHABET, :n_ALPHABET]
+        for r in rotors:
+            wiring = numpy.array([INDEX[w] for w in ROTORS[r][0]])
+            rwiring = numpy.argsort(wiring)
+            self.forward.append(((wiring[(k + s) % n_ALPHABET] - s) % n_ALPHABET).astype(numpy.uint8))
+            self.backward.append(((rwiring[(k + s) % n_ALPHABET] - s) % n_ALPHABET).astype(numpy.uint8))
+            
+            notches = numpy.zeros(n_ALPHABET, dtype=bool)
+            notches[[INDEX[n] for n in ROTORS[r][1]]] = True
+            self.notches.append(notches)
+        
+        # Inner permutation of the slow rotors and the reflector, for each shifts of the slow rotors: inner[s0, ..., key]
+        # It is fixed between two turnovers, so scrambling a key only goes through the fast rotor around it
+        indices = numpy.indices((n_ALPHABET,) * self.n_rotors)
+        keys = indices[-1]
+        for r in reversed(range(self.n_rotors-1)):
+            keys = self.forward[r][indices[r], keys]
+        keys = self.reflector[keys]
+        for r in range(self.n_rotors-1):
+            keys = self.backward[r][indices[r], keys]
+        self.inner = keys.astype(numpy.uint8)
+    
+    # Rotor shifts at each step, same stepping process as core.machine.Enigma.turnrotors
+    # Shifts, positions and ring are letters: stored as bytes, as the keys they index
+    def shifts(self, positions, ring, length):
+        shifts = numpy.empty((length, self.n_rotors) + positions.shape[:1], dtype=numpy.uint8)
+        positions = positions.T.copy()
+        ring = n_ALPHABET - ring.T
+        
+        for i in range(length):
+            if self.n_rotors >= 3:
+                middle = self.notches[-2][positions[-2]]
+                step = middle | self.notches[-1][positions[-1]]
+                positions[-3] += middle
+                positions[-2] += step
+            elif self.n_rotors == 2:
+                positions[-2] += self.notches[-1][positions[-1]]
+            positions[-1] += 1
+            positions %= n_ALPHABET
+            shifts[i] = (positions + ring) % n_ALPHABET
+        
+        return shifts.transpose(1, 2, 0)
+    
+    # Apply the scrambler to keys (2D array), rotor shifts being given for each key
+    def scramble(self, shifts, keys):
+        keys = self.forward[-1][shifts[-1], keys]
+        keys = self.inner[tuple(shifts[:-1]) + (keys,)]
+        return self.backward[-1][shifts[-1], keys]
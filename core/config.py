@@ -0,0 +1,106 @@
+from .constants import ROTORS, REFLECTORS, ALPHABET
+
+n_ALPHABET = len(ALPHABET)
+INDEX = {l: i for i, l in enumerate(ALPHABET)}
+
+ROTORS_NAMES = list(ROTORS)
+REFLECTORS_NAMES = list(REFLECTORS)
+ROTORS_INDEX = {r: i for i, r in enumerate(ROTORS_NAMES)}
+REFLECTORS_INDEX = {r: i for i, r in enumerate(REFLECTORS_NAMES)}
+
+NO_PLUGS = bytes(range(n_ALPHABET))
+
+
+# Plugboard settings ('AB CD') <-> 26 bytes involution
+# Each letter may be plugged only once, otherwise the settings are not an involution
+def parse_plugboard(plugboard):
+    plugs = bytearray(NO_PLUGS)
+    plugged = set()
+    for plug in plugboard.split():
+        if len(plug) != 2 or not all(l in INDEX for l in plug):
+            raise ValueError('Invalid plug: %s' % plug)
+        if plug[0] == plug[1] or plug[0] in plugged or plug[1] in plugged:
+            raise ValueError('Letter plugged twice in plugboard: %s' % plugboard)
+        plugged.update(plug)
+        plug0, plug1 = INDEX[plug[0]], INDEX[plug[1]]
+        plugs[plug0], plugs[plug1] = plug1, plug0
+    return bytes(plugs)
+
+
+def format_plugboard(plugs):
+    return ' '.join([ALPHABET[i] + ALPHABET[p] for i, p in enumerate(plugs) if i < p])
+
+
+# Several configurations <-> a single bytes object (cheap to send to other processes)
+def pack_configs(configs):
+    return b''.join([conf.pack() for conf in configs])
+
+
+def unpack_configs(data):
+    i = 0
+    while i < len(data):
+        j = i + 2 + 3*data[i+1] + n_ALPHABET
+        yield Config.unpack(data[i:j])
+        i = j
+
+
+# Enigma configuration stored as small integers
+# Converted from / to dicts of strings only at the REPL and files boundaries
+class Config:
+    __slots__ = ('reflector', 'rotors', 'ring', 'plugboard', 'positions')
+    
+    def __init__(self, reflector, rotors, ring, plugboard, positions):
+        self.reflector = reflector      # index in REFLECTORS_NAMES
+        self.rotors = rotors            # bytes: indexes in ROTORS_NAMES
+        self.ring = ring                # bytes: ring settings - 1
+        self.plugboard = plugboard      # bytes: 26 letters involution
+        self.positions = positions      # bytes: rotors positions
+    
+    # Ring settings default to 1 when omitted, otherwise ring settings and positions are given for each rotor (records are packed with a fixed width)
+    @classmethod
+    def from_dict(cls, conf):
+        rotors = bytes([ROTORS_INDEX[r] for r in conf['Rotors'].split()])
+        ring = [int(r) - 1 for r in conf['Ring'].split()] or [0] * len(rotors)
+        positions = bytes([INDEX[p] for p in conf['Positions']])
+        if len(ring) != len(rotors) or len(positions) != len(rotors):
+            raise ValueError('Ring settings and positions must match the %s rotors: %s' % (len(rotors), conf))
+        if not all(0 <= r < n_ALPHABET for r in ring):
+            raise ValueError('Invalid ring settings: %s' % conf['Ring'])
+        return cls(REFLECTORS_INDEX[conf['Reflector']], rotors, bytes(ring), parse_plugboard(conf['Plugboard']), positions)
+    
+    def to_dict(self):
+        return {'Reflector': REFLECTORS_NAMES[self.reflector],
+                'Rotors': ' '.join(self.rotors_names()),
+                'Ring': ' '.join([str(r + 1) for r in self.ring]),
+                'Plugboard': format_plugboard(self.plugboard),
+                'Positions': ''.join([ALPHABET[p] for p in self.positions])}
+    
+    def rotors_names(self):
+        return [ROTORS_NAMES[r] for r in self.rotors]
+    
+    def replace(self, **fields):
+        conf = Config(self.reflector, self.rotors, self.ring, self.plugboard, self.positions)
+        for field, value in fields.items():
+            setattr(conf, field, value)
+        return conf
+    
+    # Fixed-width bytes encoding: reflector, number of rotors, rotors, ring, positions, plugboard
+    def pack(self):
+        return bytes([self.reflector, len(self.rotors)]) + self.rotors + self.ring + self.positions + self.plugboard
+    
+    @classmethod
+    def unpack(cls, data):
+        n = data[1]
+        return cls(data[0], data[2:2+n], data[2+n:2+2*n], data[2+3*n:], data[2+2*n:2+3*n])
+    
+    def __reduce__(self):
+        return Config.unpack, (self.pack(),)
+    
+    def __eq__(self, other):
+        return isinstance(other, Config) and self.pack() == other.pack()
+    
+    def __hash__(self):
+        return hash(self.pack())
+    
+    def __repr__(self):
+        return repr(self.to_dict())
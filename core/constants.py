@@ -10,8 +10,8 @@ By Petitoto
 
 HELP_CMD = {'General': ['help', 'exit'],
         'Attributes': ['get', 'set', 'unset'],
-        'Configurations': ['add_config', 'gen_configs', 'gen_plugs', 'gen_ring','import_configs', 'export_configs', 'compute'],
-        'Cryptanalysis': ['crypt', 'ic_attack', 'ngram_attack', 'kp_attack', 'turing_attack', 'rejewski_attack', 'cribs_finder', 'ring_recovery'],
+        'Configurations': ['add_config', 'gen_configs', 'gen_plugs', 'gen_ring', 'expand_ring', 'import_configs', 'export_configs', 'compute'],
+        'Cryptanalysis': ['crypt', 'ic_attack', 'ngram_attack', 'kp_attack', 'plugs_attack', 'turing_attack', 'rejewski_attack', 'rejewski_catalog', 'cribs_finder', 'ring_recovery'],
         'Misc': ['count', 'turn_rotors', '#'],
         'Topics information': ['attributes', 'rotors', 'machines']}
 
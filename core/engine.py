@@ -0,0 +1,272 @@
+from itertools import groupby, chain
+
+from .constants import ROTORS, REFLECTORS, ALPHABET
+from .config import INDEX, ROTORS_NAMES, REFLECTORS_NAMES
+
+n_ALPHABET = len(ALPHABET)
+
+CACHE_SIZE = 16
+STEPPING_ROTORS = 3     # only the rightmost rotors may step, the other ones (greek rotor of the M4) are fixed during a message
+
+
+# Encode a text as a list of integers
+def encode(text):
+    return [INDEX[l] for l in text]
+
+
+# Decode a list of integers to a text
+def decode(keys):
+    return ''.join([ALPHABET[k] for k in keys])
+
+
+# Composition of two permutations (bytes): x -> perm2[perm1[x]]
+_PAD = bytes(range(n_ALPHABET, 256))
+def compose(perm1, perm2):
+    return perm1.translate(perm2 + _PAD)
+
+
+# Decrypt a list of integers under each configuration, and yield (configuration, decrypted keys as bytes)
+# An encryption is P.R_i.P (plugboard, scrambler, plugboard): consecutive configurations with the same rotor setting (as generated by gen_plugs) only differ by P,
+# so the text is scrambled once without plugboard, then for each P only the keys of plugged letters are scrambled again, and P is applied to the output as a relabeling
+# Without relabel, the output plugboard is not applied (for scores which do not depend on the letters names, like the IC)
+def crypt_configs(configs, keys, relabel=True):
+    where = [[] for _ in range(n_ALPHABET)]     # indexes of each key in the text
+    for i, k in enumerate(keys):
+        where[k].append(i)
+    
+    for _, group in groupby(configs, key=_setting):
+        first, second = next(group), next(group, None)
+        if second is None:     # single configuration: no scrambler to share
+            processed = bytes(CompiledEnigma(first).crypt_keys(keys))
+            yield first, processed if relabel else processed.translate(first.plugboard + _PAD)
+            continue
+        
+        perms = CompiledEnigma(first).scrambler(len(keys))
+        scrambled = bytes([perm[k] for perm, k in zip(perms, keys)])
+        
+        for conf in chain((first, second), group):
+            plugs = conf.plugboard
+            processed = bytearray(scrambled)
+            for l, p in enumerate(plugs):
+                if p != l:
+                    for i in where[l]:
+                        processed[i] = perms[i][p]
+            if relabel:
+                processed = processed.translate(plugs + _PAD)
+            yield conf, bytes(processed)
+
+
+def _setting(conf):
+    return conf.reflector, conf.rotors, conf.ring, conf.positions
+
+
+# Get the shared rotor core of a reflector and some rotors (indexes from core.config)
+# fixed: (rotor, shift) of the fixed rotors, folded into the reflector
+_cores = {}
+def get_core(reflector, rotors, fixed=()):
+    key = (reflector, rotors, fixed)
+    core = _cores.get(key)
+    if core is None:
+        if len(_cores) >= CACHE_SIZE:
+            del _cores[next(iter(_cores))]
+        core = _cores[key] = RotorCore(REFLECTORS_NAMES[reflector], [ROTORS_NAMES[r] for r in rotors], [(ROTORS_NAMES[r], s) for r, s in fixed])
+    return core
+
+
+# Split a configuration into the key of its rotor core (see get_core), and the ring settings and positions of its stepping rotors
+# The fixed rotors only matter by their shift (position - ring): a M4 machine is a M3 machine with a compound reflector
+def conf_core(conf):
+    n = max(len(conf.rotors) - STEPPING_ROTORS, 0)
+    fixed = tuple([(r, (p - s) % n_ALPHABET) for r, p, s in zip(conf.rotors[:n], conf.positions[:n], conf.ring[:n])])
+    return (conf.reflector, conf.rotors[n:], fixed), conf.ring[n:], conf.positions[n:]
+
+
+# Reflector and fixed rotors (rotor, shift) as a single reflector
+def compound_reflector(reflector, fixed):
+    tables = [rotor_tables(r) for r, _ in fixed]
+    keys = []
+    for k in range(n_ALPHABET):
+        for (forward, _), (_, s) in zip(reversed(tables), reversed(fixed)):
+            k = forward[s][k]
+        k = INDEX[REFLECTORS[reflector][k]]
+        for (_, backward), (_, s) in zip(tables, fixed):
+            k = backward[s][k]
+        keys.append(k)
+    return keys
+
+
+# Substitutions of a rotor for each shift: forward (towards the reflector) and backward
+# Computed once per rotor: building a core must stay cheap when texts are given up after a few letters
+_tables = {}
+def rotor_tables(rotor):
+    tables = _tables.get(rotor)
+    if tables is None:
+        wiring = [INDEX[w] for w in ROTORS[rotor][0]]
+        rwiring = [0] * n_ALPHABET
+        for i, w in enumerate(wiring):
+            rwiring[w] = i
+        forward = [[(wiring[(k + s) % n_ALPHABET] - s) % n_ALPHABET for k in range(n_ALPHABET)] for s in range(n_ALPHABET)]
+        backward = [[(rwiring[(k + s) % n_ALPHABET] - s) % n_ALPHABET for k in range(n_ALPHABET)] for s in range(n_ALPHABET)]
+        tables = _tables[rotor] = forward, backward
+    return tables
+
+
+# Enigma machine processing texts with precomputed permutation tables
+# Same behaviour as core.machine.Enigma, built from a core.config.Config
+class CompiledEnigma:
+    def __init__(self, conf):
+        self.conf = conf
+        key, self.ring, positions = conf_core(conf)
+        self.core = get_core(*key)
+        self.states = self.core.setting(self.ring)
+        self.state = self.core.pack(positions)
+        self.plugs = conf.plugboard
+    
+    def dump_conf(self):
+        fixed = self.conf.positions[:len(self.conf.positions) - len(self.ring)]
+        return self.conf.replace(positions=fixed + bytes(self.core.unpack(self.state)))
+    
+    def crypt(self, text):
+        return decode(self.crypt_keys(encode(text)))
+    
+    def crypt_keys(self, keys):
+        states, plugs, state = self.states, self.plugs, self.state
+        enc = []
+        for key in keys:
+            step = states.get(state)
+            if step is None:
+                step = self.core.step(states, self.ring, state)
+            state, perm = step
+            enc.append(plugs[perm[plugs[key]]])
+        self.state = state
+        return enc
+    
+    # Decrypt keys one at a time, for callers which may give up before the end (the rotors are turned by the number of keys consumed)
+    def iter_keys(self, keys):
+        states, plugs = self.states, self.plugs
+        for key in keys:
+            step = states.get(self.state)
+            if step is None:
+                step = self.core.step(states, self.ring, self.state)
+            self.state, perm = step
+            yield plugs[perm[plugs[key]]]
+    
+    # Permutations (plugboard included) of the next n keys, and turn the rotors by n
+    def permutations(self, n):
+        plugs = self.plugs
+        return [compose(compose(plugs, perm), plugs) for perm in self.scrambler(n)]
+    
+    # Scrambler permutations (without plugboard) of the next n keys, and turn the rotors by n
+    def scrambler(self, n):
+        states, state = self.states, self.state
+        perms = []
+        for _ in range(n):
+            step = states.get(state)
+            if step is None:
+                step = self.core.step(states, self.ring, state)
+            state, perm = step
+            perms.append(perm)
+        self.state = state
+        return perms
+    
+    def turnrotors(self):
+        step = self.states.get(self.state)
+        if step is None:
+            step = self.core.step(self.states, self.ring, self.state)
+        self.state = step[0]
+
+
+# Rotors and reflector of a machine, without ring settings nor plugboard
+# A scrambler permutation only depends on the shift (position - ring) of each rotor, so it is computed once and shared by all ring settings
+# Fixed rotors (rotor, shift) are folded into the reflector
+class RotorCore:
+    def __init__(self, reflector, rotors, fixed=()):
+        self.rotors = tuple(rotors)
+        self.n_rotors = len(rotors)
+        self.reflector = compound_reflector(reflector, fixed)
+        self.notches = [set(INDEX[n] for n in ROTORS[r][1]) for r in rotors]
+        
+        # Substitution of each rotor for each shift
+        self.forward, self.backward = [], []
+        for r in rotors:
+            forward, backward = rotor_tables(r)
+            self.forward.append(forward)
+            self.backward.append(backward)
+        
+        # Fast rotor substitutions as bytes, to be composed with translate()
+        self.fast_forward = [bytes(table) for table in self.forward[-1]]
+        self.fast_backward = [bytes(table) + _PAD for table in self.backward[-1]]
+        
+        self.perms = {}
+        self.inners = {}
+        self.settings = {}
+    
+    # Rotor positions <-> integer state
+    def pack(self, positions):
+        state = 0
+        for p in positions:
+            state = state * n_ALPHABET + p
+        return state
+    
+    def unpack(self, state):
+        positions = [0] * self.n_rotors
+        for i in reversed(range(self.n_rotors)):
+            state, positions[i] = divmod(state, n_ALPHABET)
+        return positions
+    
+    # Scrambler permutation for some rotor shifts
+    # Between two turnovers only the fast rotor steps: the inner permutation of the other rotors and the reflector is computed once per segment,
+    # then each step only composes the fast rotor around it
+    def permutation(self, shifts):
+        perm = self.perms.get(shifts)
+        if perm is None:
+            s = shifts[-1]
+            perm = self.perms[shifts] = self.fast_forward[s].translate(self.inner(shifts[:-1])).translate(self.fast_backward[s])
+        return perm
+    
+    # Permutation of the slow rotors (for some shifts) and the reflector, as a translate() table
+    def inner(self, shifts):
+        inner = self.inners.get(shifts)
+        if inner is None:
+            keys = range(n_ALPHABET)
+            for r, s in zip(reversed(range(len(shifts))), reversed(shifts)):
+                table = self.forward[r][s]
+                keys = [table[k] for k in keys]
+            keys = [self.reflector[k] for k in keys]
+            for r, s in enumerate(shifts):
+                table = self.backward[r][s]
+                keys = [table[k] for k in keys]
+            inner = self.inners[shifts] = bytes(keys) + _PAD
+        return inner
+    
+    # Stepping states of a ring setting: state -> (next state, permutation of next state)
+    def setting(self, ring):
+        states = self.settings.get(ring)
+        if states is None:
+            if len(self.settings) >= CACHE_SIZE:
+                del self.settings[next(iter(self.settings))]
+            states = self.settings[ring] = {}
+        return states
+    
+    def step(self, states, ring, state):
+        positions = self.unpack(state)
+        self.turn(positions)
+        shifts = tuple([(p - r) % n_ALPHABET for p, r in zip(positions, ring)])
+        step = states[state] = (self.pack(positions), self.permutation(shifts))
+        return step
+    
+    # Same stepping process as core.machine.Enigma.turnrotors
+    def turn(self, positions):
+        notches = self.notches
+        if self.n_rotors >= 3:
+            middle = positions[-2] in notches[-2]
+            if middle:
+                positions[-3] = (positions[-3] + 1) % n_ALPHABET
+            if middle or positions[-1] in notches[-1]:
+                positions[-2] = (positions[-2] + 1) % n_ALPHABET
+        
+        elif self.n_rotors == 2:
+            if positions[-1] in notches[-1]:
+                positions[-2] = (positions[-2] + 1) % n_ALPHABET
+        
+        positions[-1] = (positions[-1] + 1) % n_ALPHABET
@@ -0,0 +1,41 @@
+import heapq
+
+
+# Bounded selection of the k best scored items, in O(log k) per kept item
+# Items not better than the current threshold are rejected with a single comparison
+# On equal scores, the earliest pushed items are kept and ranked first
+class TopK:
+    def __init__(self, k):
+        self.k = k
+        self.heap = []      # (score, -order, item), the worst kept item on top
+        self.order = 0
+    
+    def __len__(self):
+        return len(self.heap)
+    
+    # Lowest score an item must beat to be kept (None while not full)
+    def threshold(self):
+        if self.k and len(self.heap) == self.k:
+            return self.heap[0][0]
+        return None
+    
+    def push(self, item, score):
+        self.order += 1
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, (score, -self.order, item))
+        elif self.k and score > self.heap[0][0]:
+            heapq.heapreplace(self.heap, (score, -self.order, item))
+    
+    # Push (item, score) pairs
+    def extend(self, scored):
+        heap, k = self.heap, self.k
+        for item, score in scored:
+            self.order += 1
+            if len(heap) < k:
+                heapq.heappush(heap, (score, -self.order, item))
+            elif k and score > heap[0][0]:
+                heapq.heapreplace(heap, (score, -self.order, item))
+    
+    # (score, item) pairs sorted by decreasing score
+    def results(self):
+        return [(score, item) for score, _, item in sorted(self.heap, reverse=True)]
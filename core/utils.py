@@ -1,78 +1,147 @@
 import sys
+import os
 import multiprocessing
-import gc
+import collections
+import itertools
+import signal
 import time
 
 from .constants import ROTORS, REFLECTORS
+from .config import Config, pack_configs, unpack_configs
+from .ranking import TopK
 
 
 class ProcessManager:
     class GenProcess:
-        def __init__(self, gen, *opts):
+        def __init__(self, gen, mode, *opts):
             self.gen = gen
+            self.mode = mode        # 'configs', 'scored' or 'raw' (see ProcessManager)
             self.opts = opts
         
-        def _init_globals(self, barValue):
-            global progressBarValue
-            progressBarValue = barValue
-        
-        def _configs2gen(self, i, configs):
-            for c in configs:
-                progressBarValue[i] += 1
-                yield c
-        
-        def run(self, i, configs):
-            try:
-                configs, newconfigs = (self._configs2gen, i, configs), []
-                for conf in self.gen(*self.opts, configs):
-                    newconfigs.append(conf)
-                return newconfigs
-            
-            except KeyboardInterrupt:
-                return None
+        def run(self, configs):
+            t0 = time.time()
+            if isinstance(configs, bytes):
+                configs = list(unpack_configs(configs))
+            if self.mode == 'scored':
+                newconfigs = [(score, conf.pack()) for score, conf in self.gen(*self.opts, (iter, configs))]
+            elif self.mode == 'raw':
+                newconfigs = list(self.gen(*self.opts, (iter, configs)))
+            else:
+                newconfigs = pack_configs(self.gen(*self.opts, (iter, configs)))
+            return os.getpid(), len(configs), time.time() - t0, newconfigs
+    
+    chunksize = 64          # initial chunk size, then adapted to the measured throughput
+    chunktime = 0.5         # target processing time of a chunk (s)
+    maxchunksize = 65536
+    window = 4              # chunks in flight per process
     
-    def __init__(self, gen, configs, nbprocess):
-        if not configs: raise InvalidCommand('No configuration found')
+    # ranked: gen yields (score, configuration) sorted by decreasing score, only the ranked best configurations are kept
+    # scored: gen yields (score, configuration), all the pairs are streamed (the score may be any picklable value, like a catalog key)
+    # raw: gen takes and yields any picklable items instead of configurations (like words), streamed as they are
+    def __init__(self, gen, nbprocess, progressBar=None, ranked=None, scored=False, raw=False):
         self.gen = gen
-        self.configs = configs
         self.nbprocess = nbprocess
-        self.progressbar = ProgressBar()
-        self.progressbar.addBar(len(self.configs))
+        self.progressBar = progressBar
+        self.ranked = ranked
+        self.scored = scored
+        self.raw = raw
+        self.stats = {}
     
-    def run(self, *opts):
-        length = [len(self.configs) // self.nbprocess] * self.nbprocess
-        for i in range(len(self.configs) % self.nbprocess):
-            length[i] += 1
+    # Generator streaming configurations by chunks to a pool of processes, and yielding their results in order
+    # configs is either a generators chain, or a ConfigSpace whose slices are generated by the processes themselves
+    # Idle processes pick the next pending chunk, and chunk sizes follow the measured throughput so that slow chunks do not keep the other processes waiting
+    # Only a few chunks per process are in flight, so configurations are never all stored in memory
+    def stream(self, *opts):
+        *opts, configs = opts
+        self.stats = {}
         
-        j, split = 0, []
-        for i in range(self.nbprocess):
-            split.append((j, j+length[i]))
-            j += length[i]
+        pool = multiprocessing.Pool(processes=self.nbprocess, initializer=_init_process, initargs=(self.GenProcess(self.gen, self.mode(), *opts),))
+        pending = collections.deque()
+        best = TopK(self.ranked or 0)
+        try:
+            for chunk in self._chunks(configs):
+                pending.append(pool.apply_async(_run_process, (chunk,)))
+                while pending and (len(pending) >= self.window*self.nbprocess or pending[0].ready()):
+                    yield from self._collect(pending.popleft(), best)
+            
+            while pending:
+                yield from self._collect(pending.popleft(), best)
         
-        barValue = multiprocessing.RawArray('i', [0] * self.nbprocess)
+        finally:
+            pool.terminate()
         
-        genconfs = self.GenProcess(self.gen, *opts)
-        p = multiprocessing.Pool(processes=self.nbprocess, initializer=genconfs._init_globals, initargs=(barValue,))
+        if self.ranked:
+            for _, conf in best.results():
+                yield Config.unpack(conf)
+    
+    def mode(self):
+        if self.raw:
+            return 'raw'
+        if self.scored or self.ranked:
+            return 'scored'
+        return 'configs'
+    
+    # Yield the configurations (or scored configurations, or items) of a chunk, or store its best scored configurations when ranked
+    # Chunks are collected in order, so ties keep the configurations of the earliest chunks first
+    def _collect(self, task, best):
+        results = self._result(task)
+        if self.raw:
+            return results
         
-        try:
-            map = p.starmap_async(genconfs.run, zip(range(self.nbprocess), (self.configs[i:j] for i,j in split)))
-            while not all(barValue):
-                time.sleep(0.5)
-                self.progressbar.inc(sum(barValue) - self.progressbar.value)
-            gc.collect()
-            while not map.ready():
-                time.sleep(0.5)
-                self.progressbar.inc(sum(barValue) - self.progressbar.value)
-                self.progressbar.update()
-            print('\n')
-        finally:
-            p.terminate()
+        if self.ranked:
+            best.extend((conf, score) for score, conf in results)
+            return ()
+        
+        if self.scored:
+            return ((score, Config.unpack(conf)) for score, conf in results)
+        return unpack_configs(results)
+    
+    # The progress bar of a ConfigSpace advances as the processes return their chunks
+    def _result(self, task):
+        pid, n, t, configs = task.get()
+        if self.progressBar:
+            self.progressBar.inc(n)
+        stats = self.stats.setdefault(pid, [0, 0.])
+        stats[0] += n
+        stats[1] += t
         
-        newconfs = []
-        for confs in map.get():
-            newconfs += confs
+        n, t = sum(s[0] for s in self.stats.values()), sum(s[1] for s in self.stats.values())
+        if t > 0:
+            self.chunksize = int(min(max(n / t * self.chunktime, 1), self.maxchunksize))
         
-        return newconfs
+        return configs
+    
+    def _chunks(self, configs):
+        if isinstance(configs, tuple):
+            gen, *opts = configs
+            configs = gen(*opts)
+            chunk = list(itertools.islice(configs, self.chunksize))
+            while chunk:
+                yield chunk if self.raw else pack_configs(chunk)
+                chunk = list(itertools.islice(configs, self.chunksize))
+        
+        else:
+            i = 0
+            while i < len(configs):
+                size = min(self.chunksize, max(1, (len(configs) - i) // (self.window*self.nbprocess)))   # smaller chunks at the end
+                yield configs[i:i+size]
+                i += size
+    
+    # Print the throughput of each process during the last run of stream (see MainMenu.report_processes)
+    def report(self):
+        colored = Colors()
+        for i, (n, t) in enumerate(self.stats.values()):
+            print(colored.info('Process %s: %s configurations in %.1f s (%.0f conf/s)' % (i+1, n, t, n / t if t else 0)))
+
+
+def _init_process(genprocess):
+    global process
+    process = genprocess
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _run_process(configs):
+    return process.run(configs)
 
 
 def prompt(message, validator=None):
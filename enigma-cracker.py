@@ -4,12 +4,12 @@ import cmd
 import itertools
 from threading import Thread
 import gc
-from copy import deepcopy
 import json
 import time
 
 from core.constants import BANNER, HELP_CMD, ALPHABET, ROTORS, REFLECTORS, MACHINES, STEPPING_PROCESS
 from core.utils import ProcessManager, Colors, prompt, InvalidCommand, Validators, ProgressBar
+from core.config import Config
 import modules
 
 
@@ -25,6 +25,7 @@ class MainMenu(cmd.Cmd):
     
     def __init__(self):
         self.progressBar = ProgressBar()
+        self.managers = []      # process managers of the generators chains, until their throughput is reported
         self.init(self.defaultvalues)
         super().__init__()
     
@@ -65,14 +66,27 @@ class MainMenu(cmd.Cmd):
         return text
     
     
+    def load_ngrams(self, file):
+        try:
+            return modules.ngram.load_ngrams(file)
+        except OSError:
+            raise InvalidCommand('Invalid ngram file: %s' % (file))
+        except ValueError as e:
+            raise InvalidCommand('Invalid ngram file: %s (%s)' % (file, e))
+    
+    
     def _list2gen(self, configs, progressBar):
         for c in configs:
             progressBar.inc()
-            yield deepcopy(c)
+            yield c
     
     
+    # Append configurations to the attribute 'configs', which is only replaced while unset (its count may be 0 while configurations are stored)
     def add_configs(self, configs, n):
-        if isinstance(self.configs, list) and isinstance(configs, list):
+        if self.configs is self.defaultvalues['configs']:
+            self.configs = configs
+        
+        elif isinstance(self.configs, list) and isinstance(configs, list):
             self.configs.extend(configs)
         
         else:
@@ -80,7 +94,8 @@ class MainMenu(cmd.Cmd):
                 self.progressBar = ProgressBar()
                 self.progressBar.addBar(len(self.configs))
                 self.configs = (self._list2gen, self.configs, self.progressBar)
-                configs = (configs[0], configs[1], self.progressBar)
+                if isinstance(configs, tuple) and isinstance(configs[-1], ProgressBar):
+                    configs = (*configs[:-1], self.progressBar)
             
             if isinstance(configs, list):
                 configs = (self._list2gen, configs, self.progressBar)
@@ -95,27 +110,131 @@ class MainMenu(cmd.Cmd):
         self.progressBar.addBar(n)
     
     
-    def edit_configs(self, gen, *opts, force_multiprocess=False):
-        if self.process == 1 and not force_multiprocess:
-            if isinstance(self.configs, list):
-                self.progressBar = ProgressBar()
-                self.progressBar.addBar(len(self.configs))
-                self.configs = (self._list2gen, self.configs, self.progressBar)
-            
-            self.configs = (gen, *opts, self.configs)
-        
-        else:
-            if not isinstance(self.configs, list):
-                self.do_compute('')
-            
-            if self.process > 1:
-                print(colored.info('Launching %s processes...' % self.process))
-            
-            self.configs = ProcessManager(gen, self.configs, self.process).run(*opts)
-            gc.collect()
+    # ranked: (scores generator, n) for attacks keeping the n best configurations
+    # Each process then returns its best scored configurations, merged while streaming
+    def edit_configs(self, gen, *opts, ranked=None):
+        self.configs = self.chain_configs(gen, *opts, ranked=ranked)
+    
+    
+    # Generators chain applying gen to the configurations, run by processes if several of them are set (see edit_configs)
+    # scored: gen yields (score, configuration) pairs instead of configurations
+    def chain_configs(self, gen, *opts, ranked=None, scored=False):
+        if isinstance(self.configs, list):
+            self.progressBar = ProgressBar()
+            self.progressBar.addBar(len(self.configs))
+            self.configs = (self._list2gen, self.configs, self.progressBar)
+        
+        if self.process == 1:
+            return (gen, *opts, self.configs)
+        
+        configs, progressBar = self.configs, None
+        if configs[0] == modules.generate.gen_configs:
+            _, configs, progressBar = configs  # ConfigSpace: each process generates its own slices
+        
+        n = None
+        if ranked:
+            gen, n = ranked
+        manager = ProcessManager(gen, self.process, progressBar, ranked=n, scored=scored)
+        self.managers.append(manager)
+        return (manager.stream, *opts, configs)
+    
+    
+    # Keep the n best configurations of a ranked attack (attack and n_scores: its n best configurations, without and with their scores; scores: the score of each configuration)
+    # prefilter: (length, oversample) to rank all configurations on the first letters of the text arguments (str), and only the oversample*n best of them on the whole texts
+    # A prefiltered attack is computed right away, to report its estimated miss rate: the fraction of the configurations left out of the shortlist
+    # which would have beaten the n best ones on the whole text, measured on a random sample of them
+    def ranked_attack(self, attack, n_scores, scores, n, *args, prefilter=None):
+        if prefilter and prefilter[0] < len(self.ftext):
+            length, oversample = prefilter
+            prefix = [arg[:length] if isinstance(arg, str) else arg for arg in args]
+            sample = self.sample_configs(modules.prefilter.SAMPLE)
+            self.edit_configs(attack, n*oversample, *prefix, ranked=(n_scores, n*oversample))
+            self.compute_configs()
             
+            shortlist = self.configs
+            results = modules.prefilter.rescore_n(n, scores, *args, shortlist)
+            self.configs = [conf for _, _, conf in results]
             self.progressBar = ProgressBar()
             self.progressBar.addBar(len(self.configs))
+            
+            deepest = max((rank for _, rank, _ in results), default=-1) + 1
+            print(colored.info('Prefilter: %s/%s configurations shortlisted on the first %s letters, the %s best on the whole text ranked at most %s on the prefix'
+                               % (len(shortlist), sample.size, length, len(results), deepest)))
+            
+            shortlisted = set(shortlist)
+            outside = [conf for conf in sample.configs if not conf in shortlisted]
+            if outside and results:
+                better = modules.prefilter.count_better(results[-1][0], scores, *args, (iter, outside))
+                if better:
+                    rate = better / len(outside)
+                    print(colored.fail('Prefilter: %s/%s sampled configurations left out of the shortlist beat the %s best on the whole text (estimated miss rate: %.2f%%, about %.0f configurations), try a longer prefix or a larger oversample'
+                                       % (better, len(outside), len(results), 100 * rate, rate * (sample.size - len(shortlist)))))
+                else:
+                    # None found: the miss rate is below 3/len(outside) with 95% confidence ("rule of three")
+                    print(colored.info('Prefilter: none of %s sampled configurations left out of the shortlist beat the %s best on the whole text (estimated miss rate below %.2f%%)'
+                                       % (len(outside), len(results), 100 * min(3 / len(outside), 1))))
+        
+        else:
+            self.edit_configs(attack, n, *args, ranked=(n_scores, n))
+    
+    
+    # Uniform random sample of k configurations (see modules.prefilter.Sample), drawn by index from a list or a ConfigSpace (see gen_configs)
+    # Other generators chains are wrapped to keep a sample of the configurations passing through: it is filled once they are run
+    def sample_configs(self, k):
+        sample = modules.prefilter.Sample(k)
+        if isinstance(self.configs, list):
+            sample.draw(self.configs)
+        elif self.configs[0] == modules.generate.gen_configs:
+            sample.draw(self.configs[1])
+        else:
+            self.configs = (sample.reservoir, self.configs)
+        return sample
+    
+    
+    # Parse the prefilter options of ranked attacks at the start of a line: -prefix <length> [-oversample <factor>]
+    # Return the prefilter (length, oversample) or None, and the rest of the line
+    def parse_prefilter(self, line):
+        options = {}
+        while True:
+            option, _, rest = line.lstrip().partition(' ')
+            if not option in ('-prefix', '-oversample'):
+                break
+            value, _, line = rest.lstrip().partition(' ')
+            try:
+                options[option] = int(value)
+            except ValueError:
+                raise InvalidCommand('Invalid %s value' % option[1:])
+            if not options[option] >= 1: raise InvalidCommand('Invalid %s value' % option[1:])
+        
+        if not '-prefix' in options:
+            if options: raise InvalidCommand('Missing prefix length')
+            return None, line
+        return (options['-prefix'], options.get('-oversample', modules.prefilter.OVERSAMPLE)), line
+    
+    
+    def prefilter_info(self, prefilter):
+        if not prefilter:
+            return ''
+        return ', prefiltered on %s letters (shortlist: %sx)' % prefilter
+    
+    
+    # Execute all generators (showing the progress bar) and store configurations into a list
+    def compute_configs(self):
+        self.progressBarThread()
+        gen, *opts = self.configs
+        self.configs = list(gen(*opts))
+        self.progressBar.finish()
+        self.report_processes()
+        self.progressBar = ProgressBar()
+        self.progressBar.addBar(len(self.configs))
+    
+    
+    # Print the throughput of the processes once, after the first run of the stages that used them
+    def report_processes(self):
+        for manager in self.managers:
+            if manager.stats:
+                manager.report()
+        self.managers = [manager for manager in self.managers if not manager.stats]
     
     
     def progressBarThread(self):
@@ -158,6 +277,7 @@ class MainMenu(cmd.Cmd):
             length = sum(1 for _ in configs) + len(val)
             
             self.progressBar.finish()
+            self.report_processes()
             
             if length > len(val):
                 val.append('...')
@@ -231,6 +351,7 @@ class MainMenu(cmd.Cmd):
             conf['Plugboard'] = prompt('Plugboard settings:', validator=Validators().Plugboard)
             conf['Positions'] = prompt('Position of each rotor:', validator=Validators(len(conf['Rotors'].split(' '))).Positions)
         
+        conf = Config.from_dict(conf)
         self.add_configs([conf], 1)
         print(colored.success('%s\nadded to attribute \'configs\'\n' % (conf)))
     
@@ -256,8 +377,8 @@ class MainMenu(cmd.Cmd):
                 model['Rotors'].append(prompt('Available rotors for position n°%s:' % (i+1), validator=Validators().Rotors))
             model['Duplicates'] = prompt('Allow duplicate rotors? (Y/N)', validator=Validators().YN)
         
-        n = modules.generate.gen_configs_count(model)
-        self.add_configs((modules.generate.gen_configs, model, self.progressBar), n)
+        space = modules.generate.ConfigSpace(model)
+        self.add_configs((modules.generate.gen_configs, space, self.progressBar), len(space))
         
         print(colored.success('Configurations added\n'))
     
@@ -275,12 +396,27 @@ class MainMenu(cmd.Cmd):
         '''
         Generate ring settings for each configuration, and change the rotor positions according to the new ring settings
         Use '-ringonly' to edit only ring settings
-        => gen_ring (-ringonly)
+        Use '-classes' to generate only one of the ring settings which are equivalent for the text attribute (rotors turning at the same letters), see expand_ring
+        => gen_ring (-ringonly | -classes)
         '''
-        self.edit_configs(modules.generate.gen_ring, line == '-ringonly')
+        if line == '-classes':
+            if not self.ftext: raise InvalidCommand('Missing text attribute')
+            self.edit_configs(modules.generate.gen_ring_classes, len(self.ftext))
+        else:
+            self.edit_configs(modules.generate.gen_ring, line == '-ringonly')
         print(colored.success('Ring settings added\n'))
     
     
+    def do_expand_ring(self, line):
+        '''
+        Generate all ring settings equivalent to the ring settings of each configuration for the text attribute (see gen_ring -classes)
+        => expand_ring
+        '''
+        if not self.ftext: raise InvalidCommand('Missing text attribute')
+        self.edit_configs(modules.generate.expand_ring, len(self.ftext))
+        print(colored.success('Equivalent ring settings added\n'))
+    
+    
     def do_import_configs(self, file):
         '''
         Add configurations from a file
@@ -292,7 +428,7 @@ class MainMenu(cmd.Cmd):
             try:
                 with open(file) as f:
                     for conf in f:
-                        yield json.loads(conf.strip('\n'))
+                        yield Config.from_dict(json.loads(conf.strip('\n')))
             except OSError:
                 raise InvalidCommand('Could not open file: %s' % (file))
         
@@ -319,10 +455,11 @@ class MainMenu(cmd.Cmd):
                 gen, *opts = self.configs
                 configs = gen(*opts)
             for conf in configs:
-                conf = json.dumps(conf) + '\n'
+                conf = json.dumps(conf.to_dict()) + '\n'
                 fconfig.write(conf)
             
             fconfig.close()
+            self.report_processes()
         
         except OSError:
             raise InvalidCommand('Could not open file: %s' % (file))
@@ -339,13 +476,7 @@ class MainMenu(cmd.Cmd):
         if not self.progressBar.maxval: raise InvalidCommand('No configuration found')
         
         print(colored.success('Computing configurations...'))
-        
-        self.progressBarThread()
-        gen, *opts = self.configs
-        self.configs = list(gen(*opts))
-        self.progressBar.finish()
-        self.progressBar = ProgressBar()
-        self.progressBar.addBar(len(self.configs))
+        self.compute_configs()
     
     
     # Cryptanalysis
@@ -359,7 +490,7 @@ class MainMenu(cmd.Cmd):
         if not self.progressBar.maxval: raise InvalidCommand('No configurations found')
         
         possible_args = ['-ic', '-ngram', '-kp']
-        ic, ngram, kp = False, (), ''
+        ic, ngram, kp = False, None, ''
         
         args = line.split()
         i = 0
@@ -376,18 +507,7 @@ class MainMenu(cmd.Cmd):
                     j += 1
                 file = ' '.join(file)
                 
-                try:
-                    ngrams = {}
-                    nsize = len(open(file).readline().split()[0])
-                    with open(file) as f:
-                        for line in f:
-                            gram, p = line.strip('\n').split()
-                            if not len(gram) == nsize: raise InvalidCommand('ngram file must contain ngrams of same size')
-                            ngrams[gram] = int(p)
-                except OSError:
-                    raise InvalidCommand('Invalid ngram file: %s' % (file))
-                
-                ngram = (nsize, ngrams)
+                ngram = self.load_ngrams(file)
                 i = j
                 
             elif args[i] == '-kp':
@@ -414,16 +534,14 @@ class MainMenu(cmd.Cmd):
         for i, conf in enumerate(configs):
             print(colored.bold('%s - %s' % (i+1, conf)))
             
-            rotors, reflector, ring, plugboard, positions = conf['Rotors'], conf['Reflector'], conf['Ring'], conf['Plugboard'], conf['Positions']
-            fprocessed = modules.misc.crypt(reflector, rotors, ring, plugboard, positions, self.ftext)
+            fprocessed = modules.misc.crypt(conf, self.ftext)
             processed = self.unfilter_text(fprocessed)
             
             scores = []
             if ic:
                 scores.append('IC: %.5f' % modules.ic.calcic(fprocessed))
             if ngram:
-                nsize, ngrams = ngram
-                scores.append('NGRAM: %.4f' % modules.ngram.calc_ngramscore(nsize, ngrams, fprocessed))
+                scores.append('NGRAM: %.4f' % modules.ngram.calc_ngramscore(ngram, fprocessed))
             if kp:
                 scores.append('KP: %s' % modules.known_plaintext.calc_kpscore(kp, fprocessed))
             
@@ -431,13 +549,16 @@ class MainMenu(cmd.Cmd):
                 print(colored.bold(', '.join(scores)))
             
             print(processed + '\n')
+        
+        self.report_processes()
     
     
     def do_ic_attack(self, line):
         '''
         Keep N configurations with the highest indexes of coincidence (and sort them by IC)
         Or keep configurations with index of coincidence superior to a specified value
-        => ic_attack <N> | ic_attack -ic <ic_min>
+        With -prefix, configurations are first ranked on the first letters of the text, and only the oversample*N best ones on the whole text (default oversample: 10), the configurations left out being checked on a random sample
+        => ic_attack <N> [-prefix <length> [-oversample <factor>]] | ic_attack -ic <ic_min>
         '''
         if not self.text: raise InvalidCommand('Missing text attribute')
         
@@ -449,71 +570,60 @@ class MainMenu(cmd.Cmd):
             print(colored.success('Index of coincidence attack: IC >= %s\n' % ic_min))
             self.edit_configs(modules.ic.ic_attack, ic_min, self.ftext)
         else:
+            n, _, rest = line.strip().partition(' ')
             try:
-                n = int(line)
+                n = int(n)
             except ValueError:
                 raise InvalidCommand('Invalid number of configurations')
-            print(colored.success('Index of coincidence attack: %s highest IC\n' % n))
-            self.edit_configs(modules.ic.ic_n_attack, n, self.ftext)
-            
-            if self.process > 1:
-                print(colored.info('Merging the results of the %s processes...' % self.process))
-                process = self.process
-                self.process = 1
-                self.edit_configs(modules.ic.ic_n_attack, n, self.ftext, force_multiprocess=True)
-                self.process = process
+            prefilter, rest = self.parse_prefilter(rest)
+            if rest.strip(): raise InvalidCommand('Invalid arguments')
+            print(colored.success('Index of coincidence attack: %s highest IC%s\n' % (n, self.prefilter_info(prefilter))))
+            self.ranked_attack(modules.ic.ic_n_attack, modules.ic.ic_n_scores, modules.ic.ic_scores, n, self.ftext, prefilter=prefilter)
     
     
     def do_ngram_attack(self, line):
         '''
         Keep N configurations with the highest ngram scores (and sort them by ngram)
         A ngram file is required (format : 'NGRAM count(NGRAM)' per line)
-        => ngram_attack <N> <file>
+        It is converted once into a binary <file>.bin, loaded instead while up to date
+        With -prefix, configurations are first ranked on the first letters of the text, and only the oversample*N best ones on the whole text (default oversample: 10), the configurations left out being checked on a random sample
+        => ngram_attack <N> [-prefix <length> [-oversample <factor>]] <file>
         '''
         if not line and len(line.split()) >= 2: raise InvalidCommand('Missing arguments')
         if not self.text: raise InvalidCommand('Missing text attribute')
         
-        n, file, _ = self.parseline(line)
+        n, _, rest = line.strip().partition(' ')
         
         try:
             n = int(n)
         except ValueError:
             raise InvalidCommand('Invalid number of configurations')
         
-        try:
-            ngrams = {}
-            nsize = len(open(file).readline().split()[0])
-            with open(file) as f:
-                for line in f:
-                    gram, p = line.strip('\n').split()
-                    if not len(gram) == nsize: raise InvalidCommand('ngram file must contain ngrams of same size')
-                    ngrams[gram] = int(p)
-        except OSError:
-            raise InvalidCommand('Invalid ngram file: %s' % (file))
-        
+        prefilter, file = self.parse_prefilter(rest)
+        file = file.strip()
         
-        print(colored.success('%s-gram attack: %s highest scores, based on %s\n') % (nsize, n, file))
-        self.edit_configs(modules.ngram.ngram_n_attack, n, nsize, ngrams, self.ftext)
+        model = self.load_ngrams(file)
         
-        if self.process > 1:
-            print(colored.info('Merging the results of the %s processes...' % self.process))
-            process = self.process
-            self.process = 1
-            self.edit_configs(modules.ngram.ngram_n_attack, n, nsize, ngrams, self.ftext, force_multiprocess=True)
-            self.process = process
+        print(colored.success('%s-gram attack: %s highest scores, based on %s%s\n') % (model.nsize, n, file, self.prefilter_info(prefilter)))
+        self.ranked_attack(modules.ngram.ngram_n_attack, modules.ngram.ngram_n_scores, modules.ngram.ngram_scores, n, model, self.ftext, prefilter=prefilter)
     
     
     def do_kp_attack(self, line):
         '''
         Keep N configurations which produce the closest text from a known plaintext
         Or keep configurations which produce the exact known plaintext
-        => kp_attack <N> <plaintext> | kp_attack -exact <plaintext>
+        With -prefix, configurations are first ranked on the first letters of the text, and only the oversample*N best ones on the whole text (default oversample: 10), the configurations left out being checked on a random sample
+        => kp_attack <N> [-prefix <length> [-oversample <factor>]] <plaintext> | kp_attack -exact <plaintext>
         '''
         if not len(line.split()) > 1: raise InvalidCommand('Missing arguments')
         
         n = line.split()[0]
         plaintext = line[len(n)+1:]
         
+        prefilter = None
+        if n != '-exact':
+            prefilter, plaintext = self.parse_prefilter(plaintext)
+        
         if not len(plaintext) == len(self.text): raise InvalidCommand('Known plaintext must be the corresponding plaintext of the \'text\' attribute')
                 
         if n == '-exact':
@@ -525,41 +635,97 @@ class MainMenu(cmd.Cmd):
                 n = int(n)
             except ValueError:
                 raise InvalidCommand('Invalid number of configurations')
-            print(colored.success('Known plaintext attack: %s highest scores\n' % n))
-            self.edit_configs(modules.known_plaintext.kp_score_attack, n, self.filter_text(plaintext), self.ftext)
-            
-            if self.process > 1:
-                print(colored.info('Merging the results of the %s processes...' % self.process))
-                process = self.process
-                self.process = 1
-                self.edit_configs(modules.known_plaintext.kp_score_attack, n, self.filter_text(plaintext), self.ftext, force_multiprocess=True)
-                self.process = process
+            print(colored.success('Known plaintext attack: %s highest scores%s\n' % (n, self.prefilter_info(prefilter))))
+            self.ranked_attack(modules.known_plaintext.kp_score_attack, modules.known_plaintext.kp_n_scores, modules.known_plaintext.kp_scores, n, self.filter_text(plaintext), self.ftext, prefilter=prefilter)
+    
+    
+    def do_plugs_attack(self, line):
+        '''
+        Recover the plugboard of each configuration by hill climbing, with at most N plugs
+        Plugs are added, removed or exchanged while the IC or the ngram score increases, starting from the current plugboard
+        With both '-ic' and '-ngram', the IC is used first, then ngrams (best results)
+        => plugs_attack <N> -ic | plugs_attack <N> -ngram <file> | plugs_attack <N> -ic -ngram <file>
+        '''
+        if not len(line.split()) > 1: raise InvalidCommand('Missing arguments')
+        if not self.text: raise InvalidCommand('Missing text attribute')
+        
+        n, *args = line.split()
+        try:
+            n = int(n)
+        except ValueError:
+            raise InvalidCommand('Invalid number of plugs')
+        if not 0 <= n <= 13: raise InvalidCommand('Invalid number of plugs')
+        
+        ic, file = False, None
+        if args[0] == '-ic':
+            ic = True
+            args = args[1:]
+        if args:
+            if args[0] != '-ngram': raise InvalidCommand('Invalid argument: %s' % args[0])
+            file = ' '.join(args[1:])
+            if not file: raise InvalidCommand('Missing ngram file')
+            model = self.load_ngrams(file)
+        
+        if ic:
+            print(colored.success('Plugboard attack: %s plugs, based on IC\n' % n))
+            self.edit_configs(modules.plugboard.plugs_attack, n, None, self.ftext)
+        if file:
+            print(colored.success('Plugboard attack: %s plugs, based on %s\n' % (n, file)))
+            self.edit_configs(modules.plugboard.plugs_attack, n, model, self.ftext)
     
     
     def do_turing_attack(self, line):
         '''
         Keep configurations compatible with a crib, using the Turing's bombe
+        A crib shorter than the text is tried at each possible offset: the attack is then run at once, and the offsets of each stop are reported
         => turing_attack <crib>
         '''
         if not line: raise InvalidCommand('Missing crib')
         if not self.text: raise InvalidCommand('Missing text attribute')
         
         crib = self.filter_text(line)
-        if not len(self.ftext) == len(crib): raise InvalidCommand('Crib length does not match the text attribute')
+        if len(crib) > len(self.ftext): raise InvalidCommand('Crib is longer than the text attribute')
         
         print(colored.success('Cribs based attack (Turing\'s bombe)'))
         
-        menu, node, loops = modules.turing.gen_menu(crib, self.ftext)
-        print(colored.success('Running with %d loop%s. Hypothesis: %s is fixed by the plugboard\n' % (loops, 's' if loops > 1 else '', node)))
-        self.edit_configs(modules.turing.crib_attack, menu, node)
+        if len(crib) == len(self.ftext):
+            menu, nodes, loops = modules.turing.gen_menu(crib, self.ftext)
+            print(colored.success('Running with %d loop%s. Test register%s: %s\n' % (loops, 's' if loops > 1 else '', 's' if len(nodes) > 1 else '', ' '.join(nodes))))
+            self.edit_configs(modules.turing.crib_attack, menu, nodes)
+        
+        else:
+            offsets = modules.turing.crib_offsets(crib, self.ftext)
+            if not offsets: raise InvalidCommand('The crib does not fit anywhere in the text')
+            if not self.progressBar.maxval: raise InvalidCommand('No configurations found')
+            
+            menus = []
+            for offset in offsets:
+                menu, nodes, loops = modules.turing.gen_menu(crib, self.ftext, offset)
+                menus.append((offset, menu, nodes))
+                print(colored.info('Offset %s: %d loop%s. Test register%s: %s' % (offset, loops, 's' if loops > 1 else '', 's' if len(nodes) > 1 else '', ' '.join(nodes))))
+            print(colored.success('Running at %s possible offset%s\n' % (len(offsets), 's' if len(offsets) > 1 else '')))
+            self.edit_configs(modules.turing.sliding_crib_attack, menus)
+            self.compute_configs()
+            
+            for stop in self.configs:
+                offsets = modules.turing.stop_offsets(menus, stop)
+                print(colored.info('Stop at offset%s %s: %s' % ('s' if len(offsets) > 1 else '', ', '.join(map(str, offsets)), stop)))
+            print(colored.success('%s stop%s found\n' % (len(self.configs), 's' if len(self.configs) > 1 else '')))
     
     
     def do_rejewski_attack(self, line):
         '''
         Rejewski's characteristics attack implementation
         This attack requires several message keys encrypted twice with the daily key at the begining of the message
-        => rejewski_attack <double encrypted key 1> <double encrypted key 2> ...
+        With '-catalog', add the configurations of a catalog (see rejewski_catalog) instead of filtering current configurations
+        => rejewski_attack <double encrypted key 1> <double encrypted key 2> ... | rejewski_attack -catalog <file> <keys>
         '''
+        catalog = None
+        if line.startswith('-catalog'):
+            if not len(line.split()) > 2: raise InvalidCommand('Missing arguments')
+            _, catalog, line = line.split(maxsplit=2)
+        
+        if not line: raise InvalidCommand('Missing keys')
         n2 = len(line.split()[0])
         if not not n2 % 2: raise InvalidCommand('Keys should be encrypted twice')
         if not all([len(k) == n2 for k in line.split()]): raise InvalidCommand('Invalid keys')
@@ -567,43 +733,90 @@ class MainMenu(cmd.Cmd):
         
         print(colored.success('Rejewski attack: %s keys\n' % len(line.split())))
         chains = modules.rejewski.rejewski_chains(line, n)
-        self.edit_configs(modules.rejewski.rejewski_attack, chains)
+        
+        if catalog:
+            try:
+                configs = list(modules.rejewski.catalog_attack(catalog, chains))
+            except OSError:
+                raise InvalidCommand('Could not open catalog: %s' % (catalog))
+            self.add_configs(configs, len(configs))
+            print(colored.success('%s configurations found in the catalog\n' % len(configs)))
+        
+        else:
+            self.edit_configs(modules.rejewski.rejewski_attack, chains)
+    
+    
+    def do_rejewski_catalog(self, file):
+        '''
+        Build a catalog of Rejewski's characteristics of the configurations, to be used by rejewski_attack -catalog
+        Configurations are not modified. The catalog is usually built once from gen_configs
+        => rejewski_catalog <file>
+        '''
+        if not file: raise InvalidCommand('Missing file')
+        if not self.progressBar.maxval: raise InvalidCommand('No configurations found')
+        
+        print(colored.success('Building Rejewski\'s catalog in %s...' % (file)))
+        
+        entries = self.chain_configs(modules.rejewski.catalog_entries, scored=True)
+        
+        self.progressBarThread()
+        try:
+            n = modules.rejewski.build_catalog(file, entries)
+        finally:
+            self.progressBar.finish()
+        self.report_processes()
+        
+        print(colored.success('%s configurations catalogued\n' % n))
     
     
     def do_cribs_finder(self, file):
         '''
         Find possible cribs from a wordlist
         Wordlist is a file with one crib per line
+        Cribs are sorted by the number of loops of their menus (the best ones for turing_attack first)
+        Offsets are counted in letters only, as in turing_attack
         => cribs_finder <file>
         '''
         if not file: raise InvalidCommand('Missing wordlist')
         if not self.text: raise InvalidCommand('Missing text attribute')
         
         try:
-            words = [w.strip('\n') for w in open(file).readlines()]
+            with open(file) as f:
+                print(colored.success('Cribs finder: %s' % (file)))
+                cribs = modules.cribs.find_cribs((w.strip('\n') for w in f), self.text, self.process)
         except OSError:
             raise InvalidCommand('Could not open file: %s' % (file))
         
-        print(colored.success('Cribs finder: %s' % (file)))
-        
-        cribs = modules.cribs.find_cribs(words, self.text, self.filter_text)
-        
         if not cribs:
             print(colored.fail('No crib found'))
         else:
             print(colored.success('Found possible cribs:'))
-            for c in cribs.keys():
-                encrypted = [self.text[i:i+len(c)] for i in cribs[c]]
-                print('%s:' % c)
-                print('-> %s\n' %  ' ; '.join(encrypted))
+            for c, i, loops in cribs:
+                print('%s at %s (%d loop%s):' % (c, i, loops, 's' if loops > 1 else ''))
+                print('-> %s\n' % self.ftext[i:i+len(self.filter_text(c))])
     
     
     def do_ring_recovery(self, line):
         '''
         Recover ring settings. May be launched several times
-        => ring_recovery -> follow instructions
+        Without prompts, well-decrypted blocks are found by scoring the text by IC or ngrams (see ngram_attack)
+        => ring_recovery -> follow instructions | ring_recovery -ic | ring_recovery -ngram <file>
         '''
         if not self.ftext: raise InvalidCommand('Missing text attribute')
+        
+        if line.startswith('-ic') or line.startswith('-ngram'):
+            model = None
+            if line.startswith('-ngram'):
+                file = line[6:].strip()
+                if not file: raise InvalidCommand('Missing ngram file')
+                model = self.load_ngrams(file)
+                print(colored.success('Automatic ring settings recovery, based on %s\n' % file))
+            else:
+                print(colored.success('Automatic ring settings recovery, based on IC\n'))
+            
+            self.edit_configs(modules.ring.auto_recover_ring, model, self.ftext)
+            return
+        
         print(colored.success('Ring settings recovery'))
         
         configs = self.configs
@@ -615,8 +828,7 @@ class MainMenu(cmd.Cmd):
         for i, conf in enumerate(configs):
             print(colored.bold('%s: %s' % (i+1, conf)))
             
-            rotors, reflector, ring, plugboard, positions = conf['Rotors'], conf['Reflector'], conf['Ring'], conf['Plugboard'], conf['Positions']
-            fprocessed = modules.misc.crypt(reflector, rotors, ring, plugboard, positions, self.ftext)
+            fprocessed = modules.misc.crypt(conf, self.ftext)
             processed = self.unfilter_text(fprocessed)
             
             print(processed + '\n')
@@ -625,6 +837,7 @@ class MainMenu(cmd.Cmd):
             if not block in fprocessed: raise InvalidCommand('Block not found')
             blocks.append((fprocessed.index(block), len(block)))
         
+        self.report_processes()
         self.edit_configs(modules.ring.recover_ring, blocks)
         
         print(colored.success('New ring settings applied. You may launch the command again\n'))
@@ -667,7 +880,7 @@ class MainMenu(cmd.Cmd):
             configs: Enigma configurations to encrypt, decrypt, or attack the text
             process: number of processes to launch attacks (default: 1)
         
-        NB: multi processing prevents storing configurations as generators
+        NB: with multi processing, configurations are streamed by chunks to the processes
         '''
         
         print(attributes)
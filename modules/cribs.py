@@ -1,16 +1,86 @@
-# Find possible cribs in a text
-def find_cribs(words, text, filter_text):
-    cribs = {}
-    for c in words:
-        for i in range(len(text) - len(c) + 1):
-            j = 0
-            while j < len(c) and (\
-                ('' != filter_text(c[j]) != filter_text(text[i+j]) != '') \
-                or ('' == filter_text(c[j]) == filter_text(text[i+j]) and c[j] == text[i+j])):
-                j += 1
-            if j == len(c):
-                if c in cribs:
-                    cribs[c].append(i)
-                else:
-                    cribs[c] = [i]
-    return cribs
\ No newline at end of file
+from core.constants import ALPHABET
+from core.utils import ProcessManager
+from modules.turing import count_loops
+
+
+# Find possible cribs in a text, from a stream of words (streamed by chunks to nbprocess processes, see ProcessManager)
+# A letter is never encrypted to itself, other characters must be the same in the crib and the text
+# Return (crib, offset, loops) sorted by quality of the menu of the crib at this offset (loops, then length)
+# Offsets are given in the filtered text (letters only), as used by turing_attack
+def find_cribs(words, text, nbprocess=1):
+    cribs_text = CribsText(text)
+    words = (iter, (w for w in words if w))
+    
+    if nbprocess > 1:
+        cribs = ProcessManager(_find_words, nbprocess, raw=True).stream(cribs_text, words)
+    else:
+        cribs = _find_words(cribs_text, words)
+    
+    return sorted(cribs, key=lambda c: (-c[2], -len(c[0]), c[1], c[0]))
+
+
+# Text encoded once as bitmasks: offsets of a crib are found with a few integer operations per character
+class CribsText:
+    def __init__(self, text):
+        upper = normalize(text)
+        self.size = len(upper)
+        self.ftext = ''.join([c for c in upper if c in ALPHABET])
+        
+        self.fpos = []      # index in the filtered text of each offset
+        n = 0
+        for c in upper:
+            self.fpos.append(n)
+            n += c in ALPHABET
+        
+        # Positions where each character may be placed: any other letter for a letter, the same character otherwise
+        chars = {c: int(''.join(['1' if t == c else '0' for t in reversed(upper)]), 2) for c in set(upper)}
+        letters = 0
+        for l in ALPHABET:
+            letters |= chars.get(l, 0)
+        self.allowed = {c: chars.get(c, 0) for c in set(upper) if not c in ALPHABET}
+        self.allowed.update({l: letters ^ chars.get(l, 0) for l in ALPHABET})
+        self.shifted = {}
+    
+    # Offsets of a crib, as a bitmask
+    def offsets(self, crib):
+        if len(crib) > self.size:
+            return 0
+        
+        offsets = (1 << (self.size - len(crib) + 1)) - 1
+        shifted = self.shifted
+        for j, c in enumerate(crib):
+            mask = shifted.get((c, j))
+            if mask is None:
+                mask = shifted[c, j] = self.allowed.get(c, 0) >> j
+            offsets &= mask
+            if not offsets:
+                break
+        return offsets
+    
+    # Cribs found in some words, with their offsets in the filtered text and the loops of their menus
+    def find(self, words):
+        for w in words:
+            crib = normalize(w)
+            fcrib = ''.join([c for c in crib if c in ALPHABET])
+            if not fcrib:
+                continue
+            
+            offsets, last = self.offsets(crib), None
+            while offsets:
+                low = offsets & -offsets
+                i = low.bit_length() - 1
+                offsets ^= low
+                
+                if self.fpos[i] != last:    # offsets only differing by leading non-letters
+                    last = self.fpos[i]
+                    yield w, last, count_loops(fcrib, self.ftext, last)
+
+
+# Letters in upper case, other characters unchanged
+def normalize(text):
+    return ''.join([c.upper() if c.upper() in ALPHABET else c for c in text])
+
+
+def _find_words(cribs_text, words):
+    gen, *opts = words
+    return cribs_text.find(gen(*opts))
@@ -1,78 +1,232 @@
-from itertools import product, combinations
-from copy import deepcopy
+from itertools import product, combinations, islice
+from collections import Counter
+from math import factorial, prod
 
 from core.constants import ALPHABET
+from core.config import Config, NO_PLUGS, ROTORS_INDEX, REFLECTORS_INDEX
+from core.engine import CACHE_SIZE, conf_core, get_core
 
 n_ALPHABET = len(ALPHABET)
 
-# Generate all configurations according to the specified model
-def gen_configs(model, progressBar=None):
-    rotors_possibilities = []
-    for rotor_i in model['Rotors']:
-        rotors_possibilities.append(rotor_i.split())
+# Indexable space of the configurations of a model, in the same order as product()
+# A slice of a space is a space: it can be sent to another process and generated lazily
+# Positions of the leftmost rotors vary slowest: configurations sharing the compound reflector of a M4 (see core.engine.conf_core) are consecutive
+class ConfigSpace:
+    def __init__(self, model, start=0, stop=None):
+        self.rotors_possibilities = []
+        for rotor_i in model['Rotors']:
+            self.rotors_possibilities.append([ROTORS_INDEX[r] for r in rotor_i.split()])
+        
+        self.model = model
+        self.rotors_n = model['RotorsCount']
+        self.reflectors = [REFLECTORS_INDEX[r] for r in model['Reflectors'].split()]
+        self._rotors = None
+        self.n_positions = n_ALPHABET**self.rotors_n
+        self.ring = bytes(self.rotors_n)
+        
+        size = len(self.reflectors) * count_rotors(self.rotors_possibilities, model['Duplicates']) * self.n_positions
+        self.start, self.stop, _ = slice(start, stop).indices(size)
+        self.stop = max(self.start, self.stop)
     
-    rotors_n = model['RotorsCount']
-    confs = product(model['Reflectors'].split(), *rotors_possibilities, *(ALPHABET,)*rotors_n)
+    # Rotors of the model, only enumerated when configurations are generated (not to count or slice the space)
+    @property
+    def rotors(self):
+        if self._rotors is None:
+            self._rotors = [bytes(r) for r in product(*self.rotors_possibilities) if self.model['Duplicates'] or len(set(r)) == len(r)]
+            self.rotors_rank = {r: i for i, r in enumerate(self._rotors)}
+        return self._rotors
     
-    for conf in confs:
-        if model['Duplicates'] or len(set(conf[1:rotors_n+1])) == len(conf[1:rotors_n+1]):
-            if progressBar:
-                progressBar.inc()
-            yield {'Reflector':conf[0], 'Rotors':' '.join(conf[1:rotors_n+1]), 'Ring':'1 1 1', 'Plugboard':'', 'Positions':''.join(conf[rotors_n+1:])}
+    def __len__(self):
+        return self.stop - self.start
+    
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            if i.step not in (None, 1): raise ValueError('ConfigSpace slices do not support steps')
+            start, stop, _ = i.indices(len(self))
+            return ConfigSpace(self.model, self.start + start, self.start + max(start, stop))
+        
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self): raise IndexError('ConfigSpace index out of range')
+        return self.unrank(self.start + i)
+    
+    def __iter__(self):
+        i = self.start
+        while i < self.stop:
+            index, pos = divmod(i, self.n_positions)
+            reflector, rotors = divmod(index, len(self.rotors))
+            reflector, rotors = self.reflectors[reflector], self.rotors[rotors]
+            for positions in islice(product(range(n_ALPHABET), repeat=self.rotors_n), pos, pos + self.stop - i):
+                yield Config(reflector, rotors, self.ring, NO_PLUGS, bytes(positions))
+            i += self.n_positions - pos
+    
+    # Index of a configuration in the whole space <-> configuration
+    def rank(self, conf):
+        pos = 0
+        for p in conf.positions:
+            pos = pos * n_ALPHABET + p
+        rotors = self.rotors
+        index = self.reflectors.index(conf.reflector) * len(rotors) + self.rotors_rank[conf.rotors]
+        return index * self.n_positions + pos
+    
+    def unrank(self, i):
+        index, pos = divmod(i, self.n_positions)
+        reflector, rotors = divmod(index, len(self.rotors))
+        positions = [0] * self.rotors_n
+        for j in reversed(range(self.rotors_n)):
+            pos, positions[j] = divmod(pos, n_ALPHABET)
+        return Config(self.reflectors[reflector], self.rotors[rotors], self.ring, NO_PLUGS, bytes(positions))
+
+
+# Number of rotors tuples, one rotor from the possibilities of each position
+# Without duplicates, by inclusion-exclusion over the groups of positions holding the same rotor (partitions of the positions)
+def count_rotors(possibilities, duplicates):
+    if duplicates:
+        return prod(len(p) for p in possibilities)
+    
+    counts = [Counter(p) for p in possibilities]
+    total = 0
+    for groups in _partitions(list(range(len(possibilities)))):
+        term = 1
+        for group in groups:
+            same = sum(prod(counts[i][r] for i in group) for r in counts[group[0]])
+            term *= (-1)**(len(group)-1) * factorial(len(group)-1) * same
+        total += term
+    return total
+
+
+def _partitions(items):
+    if not items:
+        yield []
+        return
+    first, rest = items[0], items[1:]
+    for groups in _partitions(rest):
+        yield [[first]] + groups
+        for i in range(len(groups)):
+            yield groups[:i] + [[first] + groups[i]] + groups[i+1:]
+
+
+# Generate all configurations of a ConfigSpace
+def gen_configs(space, progressBar=None):
+    for conf in space:
+        if progressBar:
+            progressBar.inc()
+        yield conf
 
 
 # Count configurations generated by gen_configs
 def gen_configs_count(model):
-    if model['Duplicates']:
-        n = 1
-        for r in model['Rotors']:
-            n *= len(r.split())
-    
-    else:
-        n = 0
-        rotors_possibilities = []
-        for rotor_i in model['Rotors']:
-            rotors_possibilities.append(rotor_i.split())
-        rotors = product(*rotors_possibilities)
-        for rotors in rotors:
-            if len(set(rotors)) == len(rotors):
-                n +=1
-    
-    n *= len(model['Reflectors'].split()) * n_ALPHABET**model['RotorsCount']
-    return n
+    return len(ConfigSpace(model))
 
 
 # Add a plug to each configuration
 def gen_plugs(configs):
     gen, *opts = configs
     for conf in gen(*opts):        
-        remaining_alphabet = ALPHABET
-        for l in conf['Plugboard'].replace(' ',''):
-            remaining_alphabet = remaining_alphabet.replace(l, '')
+        remaining_alphabet = [l for l in range(n_ALPHABET) if conf.plugboard[l] == l]
         
-        for p in combinations(remaining_alphabet, 2):
-            newconf = deepcopy(conf)
-            plugs = ' '.join(conf['Plugboard'].split() + [p[0]+p[1]])
-            newconf['Plugboard'] = plugs
-            yield newconf
+        for p0, p1 in combinations(remaining_alphabet, 2):
+            plugs = bytearray(conf.plugboard)
+            plugs[p0], plugs[p1] = p1, p0
+            yield conf.replace(plugboard=bytes(plugs))
 
 
 # Generate ring settings
 def gen_ring(ringonly, configs):
     gen, *opts = configs
     for conf in gen(*opts):        
-        rings = product(range(1,27), repeat=len(conf['Ring'].split()))
+        rings = product(range(n_ALPHABET), repeat=len(conf.ring))
         for r in rings:
-            newconf = deepcopy(conf)
-            r = [str(e) for e in r]
-            newconf['Ring'] = ' '.join(r)
+            ring = bytes(r)
             
-            if not ringonly:
-                newpos = []
-                for i in range(len(r)):
-                    shift = int(r[i]) - int(conf['Ring'].split()[i])
-                    pos = ALPHABET.index(conf['Positions'][i])
-                    newpos.append(ALPHABET[(pos + shift) % n_ALPHABET])
-                newconf['Positions'] = ''.join(newpos)
+            if ringonly:
+                yield conf.replace(ring=ring)
             
-            yield newconf
\ No newline at end of file
+            else:
+                positions = bytes([(p + r - r0) % n_ALPHABET for p, r, r0 in zip(conf.positions, ring, conf.ring)])
+                yield conf.replace(ring=ring, positions=positions)
+
+
+# Generate ring settings up to equivalence for a text of some length, and change the rotor positions according to the new ring settings
+# With the positions changed accordingly, ring settings only change when the rotors turn: settings whose rotors turn at the same keys of the text are equivalent
+# One setting of each class is generated, expand_ring generates all the settings of a class
+def gen_ring_classes(length, configs):
+    gen, *opts = configs
+    for conf in gen(*opts):
+        for members in ring_classes(conf, length).values():
+            yield _set_ring(conf, members[0])
+
+
+# Generate all the ring settings equivalent to the ring settings of each configuration, for a text of some length
+def expand_ring(length, configs):
+    gen, *opts = configs
+    for conf in gen(*opts):
+        classes = ring_classes(conf, length)
+        n = len(next(iter(classes.values()))[0])    # rotors turning other rotors
+        key, _, positions = conf_core(conf)
+        members = classes[_stepping_table(key[1], length)[positions[len(positions)-n:]]]
+        
+        for others in product(range(n_ALPHABET), repeat=len(conf.ring) - n):   # the other ring settings never matter
+            for r in members:
+                yield _set_ring(conf, others + r)
+
+
+# Classes of equivalent ring settings of the rotors turning other rotors: stepping class -> [ring settings of these rotors]
+# A ring setting only shifts the positions of these rotors (see _set_ring): their stepping class is looked up by position
+def ring_classes(conf, length):
+    key, ring, positions = conf_core(conf)
+    steppings = _stepping_table(key[1], length)
+    n = min(len(positions) - 1, 2)
+    shifts = [(p - r) % n_ALPHABET for p, r in zip(positions[len(positions)-n:], ring[len(ring)-n:])]
+    classes = {}
+    for r in product(range(n_ALPHABET), repeat=n):
+        classes.setdefault(steppings[bytes([(s + x) % n_ALPHABET for s, x in zip(shifts, r)])], []).append(r)
+    return classes
+
+
+# Stepping class (index of the distinct steppings, see _stepping) for each positions of the rotors turning other rotors (bytes)
+# It only depends on these rotors and on the length of the text: computed once, not for each configuration
+_steppings = {}
+def _stepping_table(rotors, length):
+    n = min(len(rotors) - 1, 2)
+    key = (len(rotors), rotors[len(rotors)-n:], length)
+    steppings = _steppings.get(key)
+    if steppings is None:
+        if len(_steppings) >= CACHE_SIZE:
+            del _steppings[next(iter(_steppings))]
+        core = get_core(0, rotors)
+        steppings = _steppings[key] = {}
+        index = {}
+        for p in product(range(n_ALPHABET), repeat=n):
+            stepping = _stepping(core, [0] * (len(rotors) - n) + list(p), length)
+            steppings[bytes(p)] = index.setdefault(stepping, len(index))
+    return steppings
+
+
+# Keys of the text at which each rotor but the fast one turns
+# Between them only the fast rotor turns: the next one is found from the distance of the fast rotor to its notches
+def _stepping(core, positions, length):
+    notches = core.notches
+    events = []
+    i = 0
+    while len(positions) > 1:
+        if not (len(positions) >= 3 and positions[-2] in notches[-2]):
+            if not notches[-1]:
+                break
+            d = min([(n - positions[-1]) % n_ALPHABET for n in notches[-1]])
+            positions[-1] = (positions[-1] + d) % n_ALPHABET
+            i += d
+        if i >= length:
+            break
+        slow = positions[:-1]
+        core.turn(positions)
+        events.append((i, tuple([p != s for p, s in zip(positions, slow)])))
+        i += 1
+    return tuple(events)
+
+
+# Change the ring settings of the rightmost rotors, and their positions accordingly
+def _set_ring(conf, ring):
+    ring = conf.ring[:len(conf.ring) - len(ring)] + bytes(ring)
+    positions = bytes([(p + r - r0) % n_ALPHABET for p, r, r0 in zip(conf.positions, ring, conf.ring)])
+    return conf.replace(ring=ring, positions=positions)
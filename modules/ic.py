@@ -1,5 +1,9 @@
 from core.constants import ALPHABET
-from core.machine import Enigma
+from core.engine import CompiledEnigma, crypt_configs, encode, decode
+from core import batch
+from core.ranking import TopK
+
+n_ALPHABET = len(ALPHABET)
 
 
 # Compute the index of coincidence of a text
@@ -17,35 +21,69 @@ def calcic(text):
     return alphabetcount/total
 
 
+# Compute the IC of the text decrypted by each configuration (by blocks if NumPy is available)
+# The IC does not depend on the names of the letters: the output plugboard (a relabeling) is not applied
+def ic_scores(ftext, configs):
+    gen, *opts = configs
+    keys = encode(ftext)
+    if batch.numpy:
+        for block in batch.blocks(gen(*opts), len(keys)):
+            yield from zip(block, batch.calcic(batch.crypt(block, keys, relabel=False)).tolist())
+    
+    else:
+        for conf, processed in crypt_configs(gen(*opts), keys, relabel=False):
+            yield conf, calcic(decode(processed))
+
+
 # Select configurations according to a minimum IC
+# Without NumPy, texts are decrypted letter by letter, and given up as soon as they cannot reach ic_min anymore
 def ic_attack(ic_min, ftext, configs):
-    gen, *opts = configs
-    for conf in gen(*opts):
-        machine = Enigma(conf['Reflector'], conf['Rotors'], conf['Ring'], conf['Plugboard'], conf['Positions'])
-        ic = calcic(machine.crypt(ftext))
-        
-        if ic >= ic_min:
-            yield conf
+    if batch.numpy:
+        for conf, ic in ic_scores(ftext, configs):
+            if ic >= ic_min:
+                yield conf
+    
+    else:
+        gen, *opts = configs
+        keys = encode(ftext)
+        for conf in gen(*opts):
+            machine = CompiledEnigma(conf)
+            if ic_reaches(ic_min, machine.iter_keys(keys), len(keys)):
+                yield conf
 
 
-# Select n configurations with highest IC (and sort them by IC)
-def ic_n_attack(n, ftext, configs):
-    nconfs = []
+# Whether a text of some length, given as a stream of keys, has an IC superior to ic_min
+# Upper bound of the IC of a partial text: all remaining letters would be the most frequent letter
+def ic_reaches(ic_min, keys, length):
+    total = length * (length-1)
+    if total == 0:
+        return 0 >= ic_min
     
-    gen, *opts = configs
-    for conf in gen(*opts):        
-        machine = Enigma(conf['Reflector'], conf['Rotors'], conf['Ring'], conf['Plugboard'], conf['Positions'])
-        ic = calcic(machine.crypt(ftext))
+    counts = [0] * n_ALPHABET
+    coincidences, most, remaining = 0, 0, length
+    for k in keys:
+        c = counts[k]
+        counts[k] = c+1
+        coincidences += 2*c
+        if c >= most:
+            most = c+1
+        remaining -= 1
         
-        if len(nconfs) < n or ic >= nconfs[-1][1]:
-            if len(nconfs) < n:
-                nconfs.append((conf, ic))
-            else:
-                nconfs[-1] = (conf, ic)
-            i = len(nconfs)-2
-            while i >= 0 and nconfs[i][1] < ic:
-                nconfs[i], nconfs[i+1] = nconfs[i+1], nconfs[i]
-                i -= 1
+        best = most + remaining
+        if (coincidences - most * (most-1) + best * (best-1)) / total < ic_min:
+            return False
     
-    for c, _ in nconfs:
+    return coincidences / total >= ic_min
+
+
+# Select n configurations with highest IC, and their IC (sorted by IC)
+def ic_n_scores(n, ftext, configs):
+    nconfs = TopK(n)
+    nconfs.extend(ic_scores(ftext, configs))
+    yield from nconfs.results()
+
+
+# Select n configurations with highest IC (and sort them by IC)
+def ic_n_attack(n, ftext, configs):
+    for _, c in ic_n_scores(n, ftext, configs):
         yield c
\ No newline at end of file
@@ -1,4 +1,6 @@
-from core.machine import Enigma
+from core.engine import CompiledEnigma, crypt_configs, encode
+from core import batch
+from core.ranking import TopK
 
 
 # Compute the known plaintext score of a text
@@ -7,37 +9,41 @@ def calc_kpscore(plaintext, text):
     return score
 
 
+# Compute the known plaintext score of the text decrypted by each configuration (by blocks if NumPy is available)
+def kp_scores(fplaintext, ftext, configs):
+    gen, *opts = configs
+    keys, plaintext = encode(ftext), encode(fplaintext)
+    if batch.numpy:
+        for block in batch.blocks(gen(*opts), len(keys)):
+            yield from zip(block, batch.calc_kpscore(plaintext, batch.crypt(block, keys)).tolist())
+    
+    else:
+        for conf, processed in crypt_configs(gen(*opts), keys):
+            yield conf, calc_kpscore(plaintext, processed)
+
+
 # Select configurations using a known plaintext
+# Texts are decrypted letter by letter, and given up at the first letter different from the plaintext
 def kp_attack(fplaintext, ftext, configs):
     gen, *opts = configs
+    keys, plaintext = encode(ftext), encode(fplaintext)
+    if len(keys) != len(plaintext):
+        return
+    
     for conf in gen(*opts):
-        machine = Enigma(conf['Reflector'], conf['Rotors'], conf['Ring'], conf['Plugboard'], conf['Positions'])
-        processed = machine.crypt(ftext)
-        
-        if processed == fplaintext:
+        machine = CompiledEnigma(conf)
+        if all(k == p for k, p in zip(machine.iter_keys(keys), plaintext)):
             yield conf
 
 
+# Select the n closest configurations from a known plaintext, and their score (sorted by score)
+def kp_n_scores(n, fplaintext, ftext, configs):
+    nconfs = TopK(n)
+    nconfs.extend(kp_scores(fplaintext, ftext, configs))
+    yield from nconfs.results()
+
+
 # Select the n closest configurations from a known plaintext (and sort them by score)
 def kp_score_attack(n, fplaintext, ftext, configs):
-    nconfs = []
-    
-    gen, *opts = configs
-    for conf in gen(*opts):
-        machine = Enigma(conf['Reflector'], conf['Rotors'], conf['Ring'], conf['Plugboard'], conf['Positions'])
-        processed = machine.crypt(ftext)
-        
-        score = calc_kpscore(fplaintext, processed)
-        
-        if len(nconfs) < n or score >= nconfs[-1][1]:
-            if len(nconfs) < n:
-                nconfs.append((conf, score))
-            else:
-                nconfs[-1] = (conf, score)
-            i = len(nconfs)-2
-            while i >= 0 and nconfs[i][1] < score:
-                nconfs[i], nconfs[i+1] = nconfs[i+1], nconfs[i]
-                i -= 1
-    
-    for c, _ in nconfs:
+    for _, c in kp_n_scores(n, fplaintext, ftext, configs):
         yield c
\ No newline at end of file
@@ -1,10 +1,12 @@
 from core.constants import ALPHABET
 from core.machine import Enigma
+from core.engine import CompiledEnigma
+from core.config import Config
 
 
 # Encrypt text + compute scores
-def crypt(reflector, rotors, ring, plugboard, positions, ftext):
-    machine = Enigma(reflector, rotors, ring, plugboard, positions)
+def crypt(conf, ftext):
+    machine = CompiledEnigma(conf)
     processed = machine.crypt(ftext)    
     return processed
 
@@ -19,15 +21,15 @@ def count(text):
 def turn_rotors(n, configs):
     gen, *opts = configs
     for conf in gen(*opts):        
-        machine = Enigma(conf['Reflector'], conf['Rotors'], conf['Ring'], conf['Plugboard'], conf['Positions'])
-        
         if n > 0:
+            machine = CompiledEnigma(conf)
             for _ in range(n):
                 machine.turnrotors()
-            conf['Positions'] = machine.dump_conf()[4]
-            yield conf
+            yield machine.dump_conf()
         
         else:
+            conf = conf.to_dict()
+            machine = Enigma(conf['Reflector'], conf['Rotors'], conf['Ring'], conf['Plugboard'], conf['Positions'])
             machines = [machine]
             for _ in range(-n):
                 newmachines = machines
@@ -42,4 +44,4 @@ def turn_rotors(n, configs):
             for machine in machines:
                 conf = {}
                 conf['Reflector'], conf['Rotors'], conf['Ring'], conf['Plugboard'], conf['Positions'] = machine.dump_conf()
-                yield conf
\ No newline at end of file
+                yield Config.from_dict(conf)
\ No newline at end of file
@@ -1,35 +1,185 @@
+import os
+import sys
+import mmap
+from array import array
 from math import log10
 
-from core.machine import Enigma
+from core.constants import ALPHABET
+from core.config import INDEX
+from core.engine import crypt_configs, encode
+from core import batch
+from core.ranking import TopK
 
+n_ALPHABET = len(ALPHABET)
 
-# Compute the ngram score of a text
-def calc_ngramscore(nsize, ngrams, text):
-    processed_ngrams = (text[i:i+nsize] for i in range(len(text) - (nsize-1)))
-    score = sum(log10(ngrams[gram]) for gram in processed_ngrams if gram in ngrams)  # NB: for unknown ngrams => ngrams[??] = 1
-    return score
+MAGIC = b'NGRAM'
+HEADER_SIZE = 8         # MAGIC, nsize, padding (aligned table)
+CACHE_EXT = '.bin'
 
 
-# Select n configuraitons with highest ngram score (and sort them by score)
-def ngram_n_attack(n, nsize, ngrams, ftext, configs):
-    nconfs = []
+# Ngram log-probabilities, stored in a flat array indexed by the base-26 code of each ngram
+# Unknown ngrams get a floor log-probability (a hundredth of a single occurrence)
+# Models loaded from a binary file are memory-mapped: processes map the same file instead of receiving a copy of the table
+class NgramModel:
+    def __init__(self, nsize, table, file=None):
+        self.nsize = nsize
+        self.table = table      # array('f') or memoryview of 26**nsize log10 probabilities
+        self.file = file        # binary file mapped by the table
     
-    gen, *opts = configs
-    for conf in gen(*opts):        
-        machine = Enigma(conf['Reflector'], conf['Rotors'], conf['Ring'], conf['Plugboard'], conf['Positions'])
-        processed = machine.crypt(ftext)
+    def __reduce__(self):
+        if self.file:
+            return NgramModel.load, (self.file,)
+        return NgramModel, (self.nsize, self.table)
+    
+    @classmethod
+    def from_counts(cls, ngrams):
+        nsize = len(next(iter(ngrams)))
+        total = sum(ngrams.values())
+        table = array('f', [log10(0.01 / total)]) * n_ALPHABET**nsize
+        for gram, count in ngrams.items():
+            if len(gram) != nsize:
+                raise ValueError('ngram file must contain ngrams of same size')
+            if not all(l in INDEX for l in gram):
+                raise ValueError('Invalid ngram: %s' % gram)
+            table[ngram_code(gram)] = log10(count / total)
+        return cls(nsize, table)
+    
+    # Text file: 'NGRAM count(NGRAM)' per line
+    @classmethod
+    def parse(cls, file):
+        ngrams = {}
+        with open(file) as f:
+            for line in f:
+                if line.strip():
+                    gram, count = line.split()
+                    ngrams[gram.upper()] = ngrams.get(gram.upper(), 0) + int(count)
+        if not ngrams:
+            raise ValueError('Empty ngram file')
+        return cls.from_counts(ngrams)
+    
+    # Binary file: MAGIC, nsize, padding, little-endian float32 table
+    # Written aside then renamed, so that models mapping a previous version of the file keep their data
+    def save(self, file):
+        table = array('f', self.table)
+        if sys.byteorder == 'big':
+            table.byteswap()
+        with open(file + '.tmp', 'wb') as f:
+            f.write(MAGIC + bytes([self.nsize]) + bytes(HEADER_SIZE - len(MAGIC) - 1))
+            table.tofile(f)
+        os.replace(file + '.tmp', file)
+    
+    @classmethod
+    def load(cls, file):
+        with open(file, 'rb') as f:
+            header = f.read(HEADER_SIZE)
+            if header[:len(MAGIC)] != MAGIC:
+                raise ValueError('Not a binary ngram file')
+            nsize = header[len(MAGIC)]
+            if os.fstat(f.fileno()).st_size != HEADER_SIZE + 4*n_ALPHABET**nsize:
+                raise ValueError('Truncated binary ngram file')
+            
+            if sys.byteorder == 'big':
+                table = array('f')
+                table.frombytes(f.read())
+                table.byteswap()
+                return cls(nsize, table)
+            
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(nsize, memoryview(data)[HEADER_SIZE:].cast('f'), os.path.abspath(file))
+    
+    # Score a text encoded as integers, rolling the ngram code along the text
+    def score(self, keys):
+        nsize, table = self.nsize, self.table
+        if len(keys) < nsize:
+            return 0.
         
-        score = calc_ngramscore(nsize, ngrams, processed)
+        high = n_ALPHABET**(nsize-1)
+        code = 0
+        for k in keys[:nsize-1]:
+            code = code*n_ALPHABET + k
         
-        if len(nconfs) < n or score >= nconfs[-1][1]:
-            if len(nconfs) < n:
-                nconfs.append((conf, score))
-            else:
-                nconfs[-1] = (conf, score)
-            i = len(nconfs)-2
-            while i >= 0 and nconfs[i][1] < score:
-                nconfs[i], nconfs[i+1] = nconfs[i+1], nconfs[i]
-                i -= 1
-    
-    for c, _ in nconfs:
-        yield c
\ No newline at end of file
+        score = 0.
+        for k in keys[nsize-1:]:
+            code = code % high * n_ALPHABET + k
+            score += table[code]
+        return score
+    
+    # Log-probability of each ngram of a text encoded as integers
+    def ngram_scores(self, keys):
+        nsize, table = self.nsize, self.table
+        high = n_ALPHABET**(nsize-1)
+        code = 0
+        for k in keys[:nsize-1]:
+            code = code*n_ALPHABET + k
+        
+        scores = []
+        for k in keys[nsize-1:]:
+            code = code % high * n_ALPHABET + k
+            scores.append(table[code])
+        return scores
+    
+    # Mean log-probability of the ngrams of a random text
+    def random_score(self):
+        return sum(self.table) / len(self.table)
+
+
+# Base-26 code of an ngram
+def ngram_code(gram):
+    code = 0
+    for l in gram:
+        code = code*n_ALPHABET + INDEX[l]
+    return code
+
+
+# Load an ngram model from a binary file, or from a text file cached as a binary file next to it
+# Either way, the returned model is mapped from the binary file if possible
+def load_ngrams(file):
+    with open(file, 'rb') as f:
+        if f.read(len(MAGIC)) == MAGIC:
+            return NgramModel.load(file)
+    
+    cache = file + CACHE_EXT
+    try:
+        if os.path.getmtime(cache) >= os.path.getmtime(file):
+            return NgramModel.load(cache)
+    except (OSError, ValueError):
+        pass
+    
+    model = NgramModel.parse(file)
+    try:
+        model.save(cache)
+        return NgramModel.load(cache)
+    except OSError:
+        return model
+
+
+# Compute the ngram score of a text
+def calc_ngramscore(model, text):
+    return model.score(encode(text))
+
+
+# Compute the ngram score of the text decrypted by each configuration (by blocks if NumPy is available)
+def ngram_scores(model, ftext, configs):
+    gen, *opts = configs
+    keys = encode(ftext)
+    if batch.numpy:
+        table = batch.ngram_table(model)
+        for block in batch.blocks(gen(*opts), len(keys)):
+            yield from zip(block, batch.calc_ngramscore(model.nsize, table, batch.crypt(block, keys)).tolist())
+    
+    else:
+        for conf, processed in crypt_configs(gen(*opts), keys):
+            yield conf, model.score(processed)
+
+
+# Select n configurations with highest ngram score, and their score (sorted by score)
+def ngram_n_scores(n, model, ftext, configs):
+    nconfs = TopK(n)
+    nconfs.extend(ngram_scores(model, ftext, configs))
+    yield from nconfs.results()
+
+
+# Select n configuraitons with highest ngram score (and sort them by score)
+def ngram_n_attack(n, model, ftext, configs):
+    for _, c in ngram_n_scores(n, model, ftext, configs):
+        yield c
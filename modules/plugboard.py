@@ -0,0 +1,72 @@
+from itertools import combinations
+
+from core.constants import ALPHABET
+from core.engine import CompiledEnigma, encode, decode
+from modules.ic import calcic
+
+n_ALPHABET = len(ALPHABET)
+
+
+# Recover the plugboard of each configuration by hill climbing, scoring decrypted texts by ngrams (or by IC if model is None)
+# Plugs already set (by the Turing's bombe for example) are the starting point
+def plugs_attack(maxplugs, model, ftext, configs):
+    gen, *opts = configs
+    keys = encode(ftext)
+    for conf in gen(*opts):
+        yield hill_climb(conf, maxplugs, model, keys)
+
+
+# Add, remove or exchange plugs as long as it improves the score (with at most maxplugs plugs)
+# The scrambler permutations of the rotor setting are computed once, each plugboard is then scored without recomputing them (see crypt_configs)
+def hill_climb(conf, maxplugs, model, keys):
+    perms = CompiledEnigma(conf).scrambler(len(keys))
+    
+    def score(plugs):
+        processed = [plugs[perm[plugs[k]]] for perm, k in zip(perms, keys)]
+        if model:
+            return model.score(processed)
+        return calcic(decode(processed))
+    
+    plugs = bytearray(conf.plugboard)
+    best = score(plugs)
+    improved = True
+    while improved:
+        improved = False
+        for a, b in combinations(range(n_ALPHABET), 2):
+            for newplugs in moves(plugs, a, b, maxplugs):
+                s = score(newplugs)
+                if s > best:
+                    plugs, best, improved = newplugs, s, True
+                    break
+    
+    return conf.replace(plugboard=bytes(plugs))
+
+
+# Plugboards one move away, changing the plugs of letters a and b
+def moves(plugs, a, b, maxplugs):
+    x, y = plugs[a], plugs[b]
+    if x == b:                      # a-b: remove the plug
+        yield _plug(plugs, (a, a), (b, b))
+    
+    elif x == a and y == b:         # a, b: add a plug
+        if sum(1 for i, p in enumerate(plugs) if i < p) < maxplugs:
+            yield _plug(plugs, (a, b))
+    
+    elif y == b:                    # a-x, b: move a plug
+        yield _plug(plugs, (a, b), (x, x))
+        yield _plug(plugs, (x, b), (a, a))
+    
+    elif x == a:                    # a, b-y: move a plug
+        yield _plug(plugs, (a, b), (y, y))
+        yield _plug(plugs, (a, y), (b, b))
+    
+    else:                           # a-x, b-y: exchange plugs
+        yield _plug(plugs, (a, b), (x, y))
+        yield _plug(plugs, (a, y), (b, x))
+
+
+def _plug(plugs, *pairs):
+    plugs = bytearray(plugs)
+    for p0, p1 in pairs:
+        plugs[p0], plugs[p1] = p1, p0
+    return plugs
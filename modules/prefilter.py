@@ -0,0 +1,47 @@
+import random
+
+from core.ranking import TopK
+
+OVERSAMPLE = 10         # shortlisted configurations per kept configuration
+SAMPLE = 1000           # configurations drawn at random, those left out of the shortlist are scored on the whole text to estimate the miss rate
+
+
+# Uniform random sample of k configurations, and the size of the population it was drawn from
+class Sample:
+    def __init__(self, k):
+        self.k = k
+        self.configs = []
+        self.size = 0
+    
+    # Draw the sample by index from a list or a ConfigSpace
+    def draw(self, configs):
+        self.size = len(configs)
+        self.configs = [configs[i] for i in random.sample(range(self.size), min(self.k, self.size))]
+    
+    # Generator passing the configurations through, keeping a sample of them (reservoir sampling)
+    def reservoir(self, configs):
+        gen, *opts = configs
+        for conf in gen(*opts):
+            self.size += 1
+            if len(self.configs) < self.k:
+                self.configs.append(conf)
+            else:
+                j = random.randrange(self.size)
+                if j < self.k:
+                    self.configs[j] = conf
+            yield conf
+
+
+# Second stage of a ranked attack prefiltered on a prefix of the text
+# shortlist: configurations sorted by decreasing score on the prefix, scored again by scores (scores generator and its arguments) on the whole text
+# Return the n best of them as (score, rank in the shortlist, configuration), sorted by decreasing score on the whole text
+def rescore_n(n, scores, *opts):
+    *opts, shortlist = opts
+    nconfs = TopK(n)
+    nconfs.extend(((rank, conf), score) for rank, (conf, score) in enumerate(scores(*opts, (iter, shortlist))))
+    return [(score, rank, conf) for score, (rank, conf) in nconfs.results()]
+
+
+# Number of configurations of a sample scoring strictly better than threshold on the whole text (scores generator and its arguments)
+def count_better(threshold, scores, *opts):
+    return sum(1 for _, score in scores(*opts) if score > threshold)
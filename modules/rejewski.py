@@ -1,5 +1,11 @@
+import dbm
+import collections
+
 from core.constants import ALPHABET
-from core.machine import Enigma
+from core.engine import CompiledEnigma, compose
+from core.config import pack_configs, unpack_configs
+
+CATALOG_SEGMENT = 16    # configurations per catalog value (some dbm implementations limit the size of a value)
 
 
 # Generate chains lengths from double encrypted keys
@@ -30,26 +36,131 @@ def rejewski_chains(keys, n):
     return chains
 
 
+# Sorted cycles lengths of a permutation (bytes)
+def cycle_type(perm):
+    visited = bytearray(len(perm))
+    cycles = []
+    for l in range(len(perm)):
+        if not visited[l]:
+            chain = 0
+            while not visited[l]:
+                visited[l] = 1
+                l = perm[l]
+                chain += 1
+            cycles.append(chain)
+    return tuple(sorted(cycles))
+
+
+# Characteristic of a configuration: cycle types of the permutations linking the letters i and i+n of its doubled keys (AD, BE, CF)
+# Computed from the 2n step permutations of the configuration
+def characteristic(conf):
+    n = len(conf.rotors)
+    perms = CompiledEnigma(conf).permutations(2*n)
+    return tuple([cycle_type(compose(perms[i], perms[i+n])) for i in range(n)])
+
+
+# Check that the chains found from some keys may come from a characteristic
+def match_chains(chains, conf_chains):
+    return all([not collections.Counter(chain) - collections.Counter(conf_chain) for chain, conf_chain in zip(chains, conf_chains)])
+
+
 # Select configurations compatible with Rejewski's characteristics
+# Complete chains (all the letters of each permutation) are compared as they are, partial chains as multisets
 def rejewski_attack(chains, configs):
     n = len(chains)
-    chains_set = [set(chains[i]) for i in range(n)]
+    complete = all(sum(chain) == len(ALPHABET) for chain in chains)
+    chains = tuple([tuple(chain) for chain in chains])
+    counters = [collections.Counter(chain) for chain in chains]
     
     gen, *opts = configs
     for conf in gen(*opts):
-        if n != len(conf['Rotors'].split()):
+        if n != len(conf.rotors):
             continue
         
-        keys = []
-        for l in ALPHABET:
-            machine = Enigma(conf['Reflector'], conf['Rotors'], conf['Ring'], conf['Plugboard'], conf['Positions'])
-            keys.append(machine.crypt(l*2*n))
+        conf_chains = characteristic(conf)
+        if complete:
+            if conf_chains == chains:
+                yield conf
+        
+        elif all([not counter - collections.Counter(conf_chain) for counter, conf_chain in zip(counters, conf_chains)]):
+            yield conf
+
+
+# Characteristic <-> catalog key ('1 1 12 12/...')
+def catalog_key(chains):
+    return '/'.join([' '.join([str(c) for c in chain]) for chain in chains]).encode()
+
+
+def parse_catalog_key(key):
+    return [[int(c) for c in chain.split()] for chain in key.decode().split('/')]
+
+
+# Key of a segment of the configurations of a characteristic in the catalog <-> (catalog key, index)
+def segment_key(key, i):
+    return key + b'#%d' % i
+
+
+def parse_segment_key(key):
+    key, _, i = key.rpartition(b'#')
+    return key, int(i)
+
+
+# Catalog key of the characteristic of each configuration
+def catalog_entries(configs):
+    gen, *opts = configs
+    for conf in gen(*opts):
+        yield catalog_key(characteristic(conf)), conf
+
+
+# Build a catalog of the characteristics of some configurations (like the Polish card catalog)
+# The catalog is an on-disk index: (characteristic, index) -> packed configurations, by segments of CATALOG_SEGMENT configurations
+# entries: generators chain of (catalog key, configuration) pairs (see catalog_entries), computed by processes if needed
+# Each segment is written once, when full (or at the end): the configurations of a characteristic are never read back
+def build_catalog(file, entries):
+    gen, *opts = entries
+    pending, segments = {}, collections.Counter()
+    n = 0
+    with dbm.open(file, 'n') as catalog:
+        for key, conf in gen(*opts):
+            confs = pending.setdefault(key, [])
+            confs.append(conf)
+            if len(confs) == CATALOG_SEGMENT:
+                _store_segment(catalog, segments, key, pending.pop(key))
+            n += 1
+        
+        for key, confs in pending.items():
+            _store_segment(catalog, segments, key, confs)
+    
+    return n
+
+
+# Configurations of a catalog compatible with chains found from some keys
+# Complete chains (all the letters of each permutation) are a direct lookup, partial chains require to check each characteristic
+def catalog_attack(file, chains):
+    try:
+        catalog = dbm.open(file, 'r')
+    except dbm.error:
+        raise OSError('Could not open catalog: %s' % file)
+    
+    with catalog:
+        if all(sum(chain) == len(ALPHABET) for chain in chains):
+            keys = [catalog_key(chains)]
         
-        conf_chains = rejewski_chains(' '.join(keys), n)
+        else:
+            keys = []
+            for key in catalog.keys():
+                key, i = parse_segment_key(key)
+                conf_chains = parse_catalog_key(key)
+                if i == 0 and len(conf_chains) == len(chains) and match_chains(chains, conf_chains):
+                    keys.append(key)
         
-        valid = True
-        for i in range(n):
-            for e in chains_set[i]:
-                valid = valid and (chains[i].count(e) <= conf_chains[i].count(e))
-        if valid:
-            yield conf
\ No newline at end of file
+        for key in keys:
+            i = 0
+            while segment_key(key, i) in catalog:
+                yield from unpack_configs(catalog[segment_key(key, i)])
+                i += 1
+
+
+def _store_segment(catalog, segments, key, confs):
+    catalog[segment_key(key, segments[key])] = pack_configs(confs)
+    segments[key] += 1
\ No newline at end of file
@@ -1,36 +1,178 @@
 from core.constants import ALPHABET
 from core.machine import Enigma
+from core.engine import CompiledEnigma, encode, decode
+from modules.ic import calcic
 
 n_ALPHABET = len(ALPHABET)
 
+STEPPING_ROTORS = 2     # rotors whose ring settings change the stepping of the machine (the rightmost ones)
+MAX_PASSES = 4          # corrections per configuration (a rotor may need a second one if the block was not precise)
+IC_WINDOW = 40          # letters per scored window, to find well-decrypted blocks
+NGRAM_WINDOW = 16
+
+
 # Recover ring settings from rotors bad length
 def recover_ring(blocks, configs):
     gen, *opts = configs
     for conf, (pos, block) in zip(gen(*opts), blocks):
-        reflector, rotors, ring, plugboard, positions = conf['Reflector'], conf['Rotors'], conf['Ring'], conf['Plugboard'], conf['Positions']
-        machine = Enigma(reflector, rotors, ring, plugboard, positions)
-        
-        size = block
-        rotor_i = -1
-        while size >= n_ALPHABET:
-            size = round(size / n_ALPHABET)
-            rotor_i -= 1
-        
-        for _ in range(pos+block):
-            machine.turnrotors()
+        yield correct_ring(conf, pos, block)[0]
+
+
+# Correct the ring settings of the rotor whose bad turnover ends a well-decrypted block
+# Return the new configuration and the index of the corrected rotor (from the right, negative)
+def correct_ring(conf, pos, block):
+    d = conf.to_dict()
+    machine = Enigma(d['Reflector'], d['Rotors'], d['Ring'], d['Plugboard'], d['Positions'])
+    
+    size = block
+    rotor_i = -1
+    while size >= n_ALPHABET:
+        size = round(size / n_ALPHABET)
+        rotor_i -= 1
+    
+    if -rotor_i > len(conf.rotors):
+        return conf, rotor_i
+    
+    for _ in range(pos+block):
+        machine.turnrotors()
+    
+    if rotor_i == -2 and len(conf.rotors) >= 3:   # Double stepping
+        size += len(machine.rotors[rotor_i].notches)
+    
+    if not machine.rotors[rotor_i].turnover():
+        size = n_ALPHABET - size
+    
+    return shift_ring(conf, rotor_i, size), rotor_i
+
+
+# Shift the ring setting and the position of a rotor together: the scrambler is unchanged, only the stepping is
+def shift_ring(conf, rotor_i, shift):
+    positions = bytearray(conf.positions)
+    positions[rotor_i] = (positions[rotor_i] + shift) % n_ALPHABET
+    
+    ring = bytearray(conf.ring)
+    ring[rotor_i] = (ring[rotor_i] + shift) % n_ALPHABET
+    
+    return conf.replace(positions=bytes(positions), ring=bytes(ring))
+
+
+# Recover ring settings without prompts, scoring decrypted texts by ngrams (or by IC if model is None)
+# The longest well-decrypted block is found over sliding windows, and corrected as in recover_ring
+# If the correction does not improve the score (or if the whole text seems well-decrypted), the other offsets of the ring settings are swept
+def auto_recover_ring(model, ftext, configs):
+    gen, *opts = configs
+    scorer = RingScorer(model)
+    keys = encode(ftext)
+    for conf in gen(*opts):
+        yield scorer.recover(conf, keys)
+
+
+class RingScorer:
+    def __init__(self, model=None):
+        self.model = model
+        if model:
+            self.window = NGRAM_WINDOW
+            self.random = model.random_score()
+        else:
+            self.window = IC_WINDOW
+            self.random = 1 / n_ALPHABET
+    
+    def recover(self, conf, keys):
+        best = self.score(conf, keys)
+        for _ in range(MAX_PASSES):
+            rotors = [-r-1 for r in range(min(STEPPING_ROTORS, len(conf.rotors)))]
+            newconf, score = conf, best
+            
+            pos, block = self.best_block(CompiledEnigma(conf).crypt_keys(keys))
+            if block < len(keys):
+                corrected, rotor_i = correct_ring(conf, pos, block)
+                candidates = [corrected]
+                if rotor_i in rotors:
+                    rotors.remove(rotor_i)
+                    candidates += [shift_ring(conf, rotor_i, s) for s in range(1, n_ALPHABET)]
+                newconf, score = self.best_conf(candidates, keys)
+            
+            for r in rotors:
+                if score > best:
+                    break
+                newconf, score = self.best_conf([shift_ring(conf, r, s) for s in range(1, n_ALPHABET)], keys)
+            
+            if not score > best:
+                break
+            conf, best = newconf, score
         
-        if rotor_i == -2 and len(rotors) >= 3:   # Double stepping
-            size += len(machine.rotors[rotor_i].notches)
+        return conf
+    
+    # First configuration with the highest score
+    def best_conf(self, candidates, keys):
+        best, best_score = None, None
+        for conf in candidates:
+            score = self.score(conf, keys)
+            if best_score is None or score > best_score:
+                best, best_score = conf, score
+        return best, best_score
+    
+    def score(self, conf, keys):
+        processed = CompiledEnigma(conf).crypt_keys(keys)
+        if self.model:
+            return self.model.score(processed)
+        return calcic(decode(processed))
+    
+    # Longest block (position, length) of well-decrypted text
+    # Each window is scored and attributed to its center: a window is well-decrypted if it scores closer to the best window than to a random text
+    def best_block(self, processed):
+        scores = self.window_scores(processed)
+        if not scores:
+            return 0, len(processed)
         
-        if not machine.rotors[rotor_i].turnover():
-            size = n_ALPHABET - size
+        threshold = (max(scores) + self.random) / 2
+        best, start = (0, 0), None
+        for i, s in enumerate(scores + [threshold - 1]):
+            if s >= threshold:
+                if start is None:
+                    start = i
+            elif start is not None:
+                if i - start > best[1]:
+                    best = (start, i - start)
+                start = None
         
-        positions = list(positions)
-        positions[rotor_i] = ALPHABET[(ALPHABET.index(positions[rotor_i]) + size) % n_ALPHABET]
-        conf['Positions'] = ''.join(positions)
+        start, length = best
+        if start == 0:
+            length += self.window // 2
+        else:
+            start += self.window // 2
+        if start + length + self.window // 2 >= len(processed):
+            length = len(processed) - start
+        return start, length
+    
+    # Score of each window of a text (mean ngram log-probability, or IC)
+    def window_scores(self, processed):
+        window = self.window
+        if len(processed) < window:
+            return []
         
-        ring = ring.split()
-        ring[rotor_i] = str((int(ring[rotor_i]) + size - 1) % n_ALPHABET + 1)
-        conf['Ring'] = ' '.join(ring)
+        if self.model:
+            grams = self.model.ngram_scores(processed)
+            n = window - self.model.nsize + 1
+            total = sum(grams[:n])
+            scores = [total / n]
+            for i in range(n, len(grams)):
+                total += grams[i] - grams[i-n]
+                scores.append(total / n)
+            return scores
         
-        yield conf
\ No newline at end of file
+        counts = [0] * n_ALPHABET
+        for k in processed[:window]:
+            counts[k] += 1
+        coincidences = sum(c * (c-1) for c in counts)
+        total = window * (window-1)
+        scores = [coincidences / total]
+        for i in range(window, len(processed)):
+            old, new = processed[i-window], processed[i]
+            coincidences -= 2 * (counts[old] - 1)
+            counts[old] -= 1
+            coincidences += 2 * counts[new]
+            counts[new] += 1
+            scores.append(coincidences / total)
+        return scores
+
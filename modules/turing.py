@@ -1,151 +1,267 @@
-from copy import deepcopy
-
 from core.constants import ALPHABET
 from core.utils import InvalidCommand
-from core.machine import Enigma
+from core.engine import get_core, conf_core
+from core.config import INDEX, parse_plugboard
+
+n_ALPHABET = len(ALPHABET)
+FULL = (1 << n_ALPHABET) - 1
 
 
-# Generate the menu for a crib and get the most connected node
-def gen_menu(crib, ftext):
+# Generate the menu for a crib (placed at offset in the text) and get its test registers
+# Return the menu, the central letters of its components with loops (best first), and their number of loops
+def gen_menu(crib, ftext, offset=0):
     menu = {}
     for i in range(len(crib)):
-        for (t1, t2) in [(ftext, crib), (crib, ftext)]:
-            if not t1[i] in menu:
-                menu[t1[i]] = []
-            menu[t1[i]].append((i, t2[i]))
+        pos = offset + i
+        for (l1, l2) in [(ftext[pos], crib[i]), (crib[i], ftext[pos])]:
+            if not l1 in menu:
+                menu[l1] = []
+            menu[l1].append((pos, l2))
+    
+    components = menu_components(menu)
+    tested = [(letters, loops) for letters, loops in components if loops > 0] or components[:1]
+    nodes = [max(letters, key=lambda l: len(menu[l])) for letters, _ in tested]
+    return menu, nodes, sum(loops for _, loops in tested)
+
+
+# Number of independent loops of the menu of a crib (placed at offset in the text), without building the menu
+# Each connection either links two components or closes a loop
+def count_loops(crib, ftext, offset=0):
+    parent = list(range(n_ALPHABET))
+    loops = 0
+    for c, t in zip(crib, ftext[offset:]):
+        a, b = INDEX[c], INDEX[t]
+        while parent[a] != a:
+            a = parent[a]
+        while parent[b] != b:
+            b = parent[b]
+        if a == b:
+            loops += 1
+        else:
+            parent[a] = b
+    return loops
+
+
+# Connected components of a menu and their number of independent loops, best first
+# Loops are counted with a union-find: cycle rank = connections - letters + 1 for each component
+def menu_components(menu):
+    parent = {l: l for l in menu}
+    def find(l):
+        while parent[l] != l:
+            parent[l] = parent[parent[l]]
+            l = parent[l]
+        return l
     
-    def dfs(first, prec, cur):
-        loops = []
-        prec = prec[:]
-        prec.append(cur)
-        for _, n in menu[cur]:
-            if n == first and n not in prec[-2:]:
-                loops.append(1)
-            if n not in prec:
-                loops_n = dfs(first, prec, n)
-                for l in loops_n:
-                    loops.append(l+1)
-        return loops
+    for l1, connections in menu.items():
+        for _, l2 in connections:
+            parent[find(l1)] = find(l2)
     
-    max = (ALPHABET[0], 0, 0)
-    for n in menu.keys():
-        loops = dfs(n, [], n)
-        if len(loops) > max[1]:
-            max = (n, len(loops), sum(loops))
-        elif len(loops) == max[1] and sum(loops) > max[2]:
-            max = (n, len(loops), sum(loops))
+    components = {}
+    for l in sorted(menu):
+        components.setdefault(find(l), []).append(l)
     
-    return menu, max[0], max[1]//2
+    ranked = []
+    for letters in components.values():
+        positions = set(pos for l in letters for pos, _ in menu[l])
+        ranked.append((letters, len(positions) - len(letters) + 1))
+    ranked.sort(key=lambda c: (c[1], len(c[0])), reverse=True)
+    return ranked
 
 
 # Select configurations compatible with a menu generated from a crib (using Turing's bombe)
-# Hypothesis : node is fixed by the plugboard
-def crib_attack(menu, node, configs):
+# nodes: test registers, one per component of the menu
+def crib_attack(menu, nodes, configs):
     bombe = Bombe(menu)
+    nodes = [INDEX[node] for node in nodes]
     
     gen, *opts = configs
     for conf in gen(*opts):
-        bombe.desenergize()
-        bombe.set_conf(conf['Reflector'], conf['Rotors'], conf['Ring'], conf['Positions'])
-        bombe.energize(node, node)
-        if bombe.check_stop(node):
-            plugboard = bombe.get_plugboard()
-            conf['Plugboard'] = plugboard
-            yield conf
+        bombe.set_conf(conf)
+        plugboard = bombe.test(nodes)
+        if plugboard is not None:
+            yield conf.replace(plugboard=parse_plugboard(plugboard))
+
+
+# Offsets where a crib may be placed in the text (a letter is never encrypted to itself)
+def crib_offsets(crib, ftext):
+    offsets = []
+    for offset in range(len(ftext) - len(crib) + 1):
+        if all(c != t for c, t in zip(crib, ftext[offset:])):
+            offsets.append(offset)
+    return offsets
+
+
+# Select configurations compatible with a crib at any of its offsets, each offset having its own menu: [(offset, menu, nodes), ...]
+# A configuration stopping with the same plugboard at several offsets is selected once (see stop_offsets)
+def sliding_crib_attack(menus, configs):
+    scrambler, bombes = sliding_bombes(menus)
+    
+    gen, *opts = configs
+    for conf in gen(*opts):
+        scrambler.set_conf(conf)
+        stops = set()
+        for _, plugs in _test_bombes(bombes):
+            stop = conf.replace(plugboard=plugs)
+            if not stop.pack() in stops:
+                stops.add(stop.pack())
+                yield stop
+
+
+# Offsets at which a configuration selected by sliding_crib_attack stops, with its plugboard
+def stop_offsets(menus, stop):
+    scrambler, bombes = sliding_bombes(menus)
+    scrambler.set_conf(stop)
+    return [offset for offset, plugs in _test_bombes(bombes) if plugs == stop.plugboard]
+
+
+# Bombes of the menus of a crib at its offsets: all of them share the same scrambler window, computed once per configuration
+def sliding_bombes(menus):
+    scrambler = Scrambler(max([pos+1 for _, menu, _ in menus for connections in menu.values() for pos, _ in connections], default=0))
+    bombes = [(offset, Bombe(menu, scrambler), [INDEX[node] for node in nodes]) for offset, menu, nodes in menus]
+    return scrambler, bombes
+
+
+# (offset, plugboard) of each stop, the scrambler being set
+def _test_bombes(bombes):
+    for offset, bombe, nodes in bombes:
+        plugboard = bombe.test(nodes)
+        if plugboard is not None:
+            yield offset, parse_plugboard(plugboard)
 
 
 # Turing's Bombe
+# The test register of each bus is a 26 bits mask of its energized keys
 class Bombe:
-    def __init__(self, menu):
-        self.bus = {bus: Bus(bus, menu[bus]) if bus in menu else Bus(bus) for bus in ALPHABET}
-        self.scrambler = None
-        self.diagonalboard = DiagonalBoard()
+    # scrambler: Scrambler shared with other bombes (set_conf is then called on the scrambler itself)
+    def __init__(self, menu, scrambler=None):
+        self.connections = [[(pos, INDEX[wbus]) for pos, wbus in menu.get(bus, [])] for bus in ALPHABET]
+        self.components = {}
+        for letters, _ in menu_components(menu):
+            for l in letters:
+                self.components[INDEX[l]] = [INDEX[l] for l in letters]
+        self.registers = [0] * n_ALPHABET
+        self.scrambler = scrambler or Scrambler(max([pos+1 for connections in self.connections for pos, _ in connections], default=0))
+    
+    def set_conf(self, conf):
+        self.scrambler.set_conf(conf)
+    
+    # Run the bombe on several test registers (one per component of the menu): all of them must stop consistently
+    # Return the plugboard deduced from the stops ('AB CD', letters found unplugged are left out), or None
+    def test(self, nodes):
+        plugs = {}
+        for node in nodes:
+            stop = self.test_register(node)
+            if stop is None:
+                return None
+            for bus, key in stop.items():
+                if plugs.setdefault(bus, key) != key:
+                    return None
+        
+        return ' '.join([ALPHABET[bus] + ALPHABET[key] for bus, key in sorted(plugs.items()) if bus < key])
     
-    def set_conf(self, reflector, rotors, ring, positions):
-        self.scrambler = Scrambler(reflector, rotors, ring, positions)
+    # Test all the hypotheses of a register, starting with the register letter being fixed by the plugboard
+    # Each current tests at once all the keys it energizes, so the next one is sent through a key left unenergized
+    # A stop also requires all the buses of the component of the register to stop, with a consistent plugboard
+    def test_register(self, node):
+        untested = FULL
+        key = node
+        while untested:
+            self.desenergize()
+            self.energize(node, key)
+            untested &= ~self.registers[node]
+            if all(self.check_stop(bus) is not None for bus in self.components[node]):
+                plugs = self.get_plugboard()
+                if plugs is not None:
+                    return plugs
+            key = untested.bit_length() - 1
+        return None
     
+    # Energize a key of a bus, and all the keys connected to it (diagonal board and scramblers)
+    # Current is propagated with a worklist of wires, and stops once the first bus is fully energized (no stop possible)
     def energize(self, bus, key):
-        if not self.scrambler: raise InvalidCommand('Missing Enigma configuration for scramblers')
+        if self.scrambler.perms is None: raise InvalidCommand('Missing Enigma configuration for scramblers')
         
-        if not self.bus[bus].keys[key].energized:
-            self.bus[bus].keys[key].energized = True
+        registers, connections, perms = self.registers, self.connections, self.scrambler.perms
+        test, full = bus, FULL
+        wires = [(bus, key)]
+        while wires:
+            bus, key = wires.pop()
+            if registers[bus] >> key & 1:
+                continue
+            registers[bus] |= 1 << key
+            if registers[test] == full:
+                return
             
-            wires = []
-            wires.append(self.diagonalboard.get(bus, key))
-            for pos, wbus in self.bus[bus].connections:
-                wkey = self.scrambler.get(pos, key)
-                wires.append((wbus, wkey))
-            
-            for wbus, wkey in wires:
-                self.energize(wbus, wkey)
+            wires.append((key, bus))    # diagonal board
+            for pos, wbus in connections[bus]:
+                wires.append((wbus, perms[pos][key]))
     
     def desenergize(self):
-        for bus in self.bus.values():
-            for key in bus.keys.values():
-                key.energized = False
+        self.registers = [0] * n_ALPHABET
     
     def check_stop(self, bus):
-        energized = []
-        for k in self.bus[bus].keys.values():
-            if k.energized:
-                energized.append(k.key)
+        energized = self.registers[bus]
+        count = bin(energized).count('1')
         
-        if len(energized) == 1:
-            return energized[0]
+        if count == 1:
+            return energized.bit_length() - 1
         
-        elif len(energized) == len(ALPHABET)-1:
-            k = 0
-            while k < len(ALPHABET) and ALPHABET[k] in energized:
-                k += 1
-            return ALPHABET[k]
+        elif count == n_ALPHABET-1:
+            return (FULL ^ energized).bit_length() - 1
         
         else:
             return None
     
-    def get_plugboard(self):        
-        plugboard = []
-        for bus in ALPHABET:
+    # Plugs deduced from the stopped buses ({bus: key}, both ways, unplugged letters included)
+    # Return None if two stops plug a letter to different letters: such a stop is not a possible plugboard
+    def get_plugboard(self):
+        plugs = {}
+        for bus in range(n_ALPHABET):
             key = self.check_stop(bus)
-            if key and not key+bus in plugboard:
-                plugboard.append(bus+key)
+            if key is not None:
+                if plugs.setdefault(bus, key) != key or plugs.setdefault(key, bus) != bus:
+                    return None
         
-        return ' '.join(plugboard)
-
-
-class Bus:
-    def __init__(self, letter, connections=[]):
-        self.letter = letter
-        self.keys = {k: Key(k) for k in ALPHABET}
-        self.connections = connections
-
-
-class Key:
-    def __init__(self, key):
-        self.key = key
-        self.energized = False
+        return plugs
 
 
+# Scrambler permutations of the first positions of a configuration, kept as a sliding window
+# Consecutive configurations mostly differ by one rotor step (gen_configs sweeps), so the window is then shifted rather than recomputed
 class Scrambler:
-    def __init__(self, reflector, rotors, ring, positions):
-        self.reflector = reflector
-        self.rotors = rotors 
-        self.ring = ring
-        self.positions = positions
-        self.computed = {}
+    def __init__(self, length):
+        self.length = length
+        self.setting = None     # (core key, ring)
+        self.states = []        # state after each step
+        self.offsets = {}       # state -> number of steps to reach it
+        self.perms = None       # permutation of each position
     
-    def get(self, pos, key):
-        if not pos in self.computed.keys():
-            enigma = Enigma(self.reflector, self.rotors, self.ring, '', self.positions)
-            for _ in range(pos+1):
-                enigma.turnrotors()
-            self.computed[pos] = enigma
+    def set_conf(self, conf):
+        key, ring, positions = conf_core(conf)
+        core = get_core(*key)
+        states = core.setting(ring)
+        start = core.pack(positions)
         
+        shift = 0
+        if self.setting == (key, ring):
+            shift = self.offsets.get(start, 0)
         else:
-            enigma = self.computed[pos]
+            self.setting = (key, ring)
         
-        return enigma.crypt_key(key)
-
-
-class DiagonalBoard:
-    def get(self, bus, key):
-        return key, bus
\ No newline at end of file
+        if shift:
+            self.states, self.perms = self.states[shift:], self.perms[shift:]
+        else:
+            self.states, self.perms = [], []
+        
+        state = self.states[-1] if self.states else start
+        while len(self.perms) < self.length:
+            step = states.get(state)
+            if step is None:
+                step = core.step(states, ring, state)
+            state, perm = step
+            self.states.append(state)
+            self.perms.append(perm)
+        
+        self.offsets = {state: i+1 for i, state in reversed(list(enumerate(self.states)))}
+    
+    def get(self, pos, key):
+        return self.perms[pos][key]